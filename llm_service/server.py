@@ -1,11 +1,14 @@
-import os, json, logging
+import os, json, logging, threading, time, asyncio
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, HTTPException, Header, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 from pydantic import BaseModel
-from llama_cpp import Llama
-from jinja2 import Environment, FileSystemLoader
 from dotenv import load_dotenv
 
+# llama_cpp и jinja2 импортируются лениво: сервер начинает отвечать на /healthz
+# до загрузки тяжёлых модулей, а прогрев выполняется в фоне (см. warm_up)
+
 # Настройка логирования
 logging.basicConfig(
     level=logging.INFO,
@@ -18,42 +21,103 @@ load_dotenv()
 
 API_KEY = os.getenv("OPENAI_API_KEY", "")
 
-# Читаем реестр моделей
-try:
-    with open("models.json") as f:
-        json_content = f.read()
-        # Удаляем комментарии JavaScript, если они есть
-        lines = [line for line in json_content.split('\n') if not line.strip().startswith('//')]
-        clean_json = '\n'.join(lines)
-        MODEL_CONFIG = json.loads(clean_json)
-    logger.info(f"Загружено {len(MODEL_CONFIG)} моделей из models.json")
-except Exception as e:
-    logger.error(f"Ошибка загрузки models.json: {str(e)}")
-    MODEL_CONFIG = {
-        "current": "models/DeepSeek-R1-Distill-Qwen-14B-Q4_K_L.gguf"
-    }
+# Реестр моделей читается при первом обращении (или при прогреве)
+MODEL_CONFIG = None
+config_lock = threading.Lock()
+
+def load_model_config():
+    global MODEL_CONFIG
+    with config_lock:
+        if MODEL_CONFIG is not None:
+            return MODEL_CONFIG
+        try:
+            with open("models.json") as f:
+                json_content = f.read()
+                # Удаляем комментарии JavaScript, если они есть
+                lines = [line for line in json_content.split('\n') if not line.strip().startswith('//')]
+                clean_json = '\n'.join(lines)
+                MODEL_CONFIG = json.loads(clean_json)
+            logger.info(f"Загружено {len(MODEL_CONFIG)} моделей из models.json")
+        except Exception as e:
+            logger.error(f"Ошибка загрузки models.json: {str(e)}")
+            MODEL_CONFIG = {
+                "current": "models/DeepSeek-R1-Distill-Qwen-14B-Q4_K_L.gguf"
+            }
+        return MODEL_CONFIG
 
 # Кэш инстансов
 llama_instances = {}
+llama_lock = threading.Lock()
+
+# llama_cpp.Llama не потокобезопасен: инференс одной модели выполняется по одному запросу
+inference_locks = {}
+
+def get_inference_lock(name: str) -> threading.Lock:
+    with llama_lock:
+        return inference_locks.setdefault(name, threading.Lock())
+
+# Модели, загружаемые при прогреве (через запятую; пустая строка — без предзагрузки)
+PRELOAD_MODELS = [m.strip() for m in os.getenv("PRELOAD_MODELS", "current").split(",") if m.strip()]
 
-app = FastAPI()
+# Состояние прогрева для /readyz
+startup_state = {"started_at": time.time(), "ready": False, "ready_after": None, "errors": []}
 
 # Настройка загрузчика шаблонов с учетом stable/experimental
 template_path = os.getenv("PROMPT_TEMPLATE_PATH", "stable")
 prompts_base_dir = "prompts"
 templates_dir = os.path.join(prompts_base_dir, template_path)
+env = None
+env_lock = threading.Lock()
+
+def get_env():
+    """Окружение Jinja2 создаётся при первом обращении"""
+    global env, templates_dir
+    with env_lock:
+        if env is None:
+            from jinja2 import Environment, FileSystemLoader
+
+            # Создаем директории, если не существуют
+            os.makedirs(os.path.join(prompts_base_dir, "stable"), exist_ok=True)
+            os.makedirs(os.path.join(prompts_base_dir, "experimental"), exist_ok=True)
+
+            # Проверяем существование директории и используем её или базовую
+            if not os.path.exists(templates_dir):
+                logger.warning(f"Директория шаблонов {templates_dir} не найдена. Используем базовую директорию prompts/")
+                templates_dir = prompts_base_dir
+
+            env = Environment(loader=FileSystemLoader(templates_dir))
+            logger.info(f"Загрузчик шаблонов настроен на директорию: {templates_dir}")
+        return env
+
+def warm_up():
+    """Фоновый прогрев: реестр моделей, шаблоны и предзагрузка моделей"""
+    try:
+        load_model_config()
+        prompt_template = os.getenv("PROMPT_TEMPLATE", "bpmn")
+        if prompt_template:
+            get_env().get_template(f"{prompt_template}.tpl")
+    except Exception as e:
+        logger.error(f"Ошибка прогрева шаблонов: {str(e)}")
+        startup_state["errors"].append(str(e))
 
-# Создаем директории, если не существуют
-os.makedirs(os.path.join(prompts_base_dir, "stable"), exist_ok=True)
-os.makedirs(os.path.join(prompts_base_dir, "experimental"), exist_ok=True)
+    for name in PRELOAD_MODELS:
+        try:
+            get_llama(name)
+        except Exception as e:
+            detail = getattr(e, "detail", str(e))
+            logger.error(f"Не удалось предзагрузить модель {name}: {detail}")
+            startup_state["errors"].append(f"{name}: {detail}")
 
-# Проверяем существование директории и используем её или базовую
-if not os.path.exists(templates_dir):
-    logger.warning(f"Директория шаблонов {templates_dir} не найдена. Используем базовую директорию prompts/")
-    templates_dir = prompts_base_dir
+    startup_state["ready"] = True
+    startup_state["ready_after"] = round(time.time() - startup_state["started_at"], 3)
+    logger.info(f"Прогрев завершён за {startup_state['ready_after']} с")
 
-env = Environment(loader=FileSystemLoader(templates_dir))
-logger.info(f"Загрузчик шаблонов настроен на директорию: {templates_dir}")
+@asynccontextmanager
+async def lifespan(app):
+    threading.Thread(target=warm_up, daemon=True).start()
+    yield
+
+app = FastAPI(lifespan=lifespan)
 
 # Добавляем CORS middleware
 app.add_middleware(
@@ -77,19 +141,22 @@ class ChatRequest(BaseModel):
     temperature: float = float(os.getenv("TEMPERATURE", "0.8"))
     stream: bool = True
 
-def get_llama(name: str) -> Llama:
-    if name not in MODEL_CONFIG:
+def get_llama(name: str) -> "Llama":
+    if name not in load_model_config():
         raise HTTPException(404, "Model not found")
-    if name not in llama_instances:
-        path = MODEL_CONFIG[name]
-        # создаём Llama‑инстанс с GPU‑опциями
-        logger.info(f"Загрузка модели: {name} из {path}")
-        llama_instances[name] = Llama(
-            model_path=path,
-            n_ctx=ChatRequest.model_fields['n_ctx'].default,
-            n_gpu_layers=ChatRequest.model_fields['n_gpu_layers'].default
-        )
-    return llama_instances[name]
+    with llama_lock:
+        if name not in llama_instances:
+            from llama_cpp import Llama
+
+            path = MODEL_CONFIG[name]
+            # создаём Llama‑инстанс с GPU‑опциями
+            logger.info(f"Загрузка модели: {name} из {path}")
+            llama_instances[name] = Llama(
+                model_path=path,
+                n_ctx=ChatRequest.model_fields['n_ctx'].default,
+                n_gpu_layers=ChatRequest.model_fields['n_gpu_layers'].default
+            )
+        return llama_instances[name]
 
 @app.get("/")
 async def root():
@@ -97,26 +164,48 @@ async def root():
     return {
         "name": "LLM Inference Server",
         "status": "running",
-        "models": list(MODEL_CONFIG.keys()),
+        "models": list(load_model_config().keys()),
         "prompt_path": template_path
     }
 
+@app.get("/healthz")
+async def healthz():
+    """Проверка живости: процесс запущен и обслуживает запросы"""
+    return {"status": "alive"}
+
+@app.get("/readyz")
+async def readyz():
+    """Проверка готовности: прогрев шаблонов и моделей завершён"""
+    if not startup_state["ready"]:
+        return JSONResponse(status_code=503, content={"status": "warming_up"})
+    content = {
+        "status": "failed" if startup_state["errors"] else "ready",
+        "ready_after": startup_state["ready_after"],
+        "models_loaded": list(llama_instances.keys()),
+        "errors": startup_state["errors"]
+    }
+    return JSONResponse(status_code=503 if startup_state["errors"] else 200, content=content)
+
 @app.get("/v1/models")
 async def list_models(authorization: str = Header(None)):
     if authorization != f"Bearer {API_KEY}":
         raise HTTPException(401, "Unauthorized")
-    return {"models": list(MODEL_CONFIG.keys())}
+    return {"models": list(load_model_config().keys())}
 
 @app.post("/v1/models/{name}/reload")
 async def reload_model(name: str, authorization: str = Header(None)):
     if authorization != f"Bearer {API_KEY}":
         raise HTTPException(401, "Unauthorized")
     
-    if name not in MODEL_CONFIG:
+    if name not in load_model_config():
         raise HTTPException(404, f"Модель '{name}' не найдена")
         
-    # Удаляем из кэша для перезагрузки
-    llama_instances.pop(name, None)
+    # Удаляем из кэша для перезагрузки (под блокировкой: модель может загружаться в этот момент)
+    def forget():
+        with llama_lock:
+            llama_instances.pop(name, None)
+
+    await asyncio.to_thread(forget)
     logger.info(f"Модель {name} удалена из кэша и будет перезагружена")
     
     return {"status": "reloaded", "model": name}
@@ -126,7 +215,7 @@ async def get_prompt(name: str, authorization: str = Header(None), **kwargs):
     if authorization != f"Bearer {API_KEY}":
         raise HTTPException(401, "Unauthorized")
     try:
-        tpl = env.get_template(f"{name}.tpl")
+        tpl = get_env().get_template(f"{name}.tpl")
         logger.info(f"Загружен шаблон {name}.tpl из {templates_dir}")
         return {"prompt": tpl.render(**kwargs)}
     except Exception as e:
@@ -152,7 +241,9 @@ async def set_prompt_path(request: Request, authorization: str = Header(None)):
         templates_dir = os.path.join(prompts_base_dir, path)
         
         # Перезагружаем окружение Jinja2
-        env = Environment(loader=FileSystemLoader(templates_dir))
+        from jinja2 import Environment, FileSystemLoader
+        with env_lock:
+            env = Environment(loader=FileSystemLoader(templates_dir))
         
         logger.info(f"Путь к промптам изменен на: {templates_dir}")
         
@@ -169,18 +260,24 @@ async def chat(
     if authorization != f"Bearer {API_KEY}":
         raise HTTPException(401, "Unauthorized")
 
-    # Загружаем модель
-    llama = get_llama(req.model)
-    
-    # Обновляем параметры инференса
-    llama.n_ctx = req.n_ctx
-    
+    # Пока идёт прогрев, модель загружается в фоне: отвечаем 503, а не ждём блокировку
+    if not startup_state["ready"]:
+        return JSONResponse(
+            status_code=503,
+            content={"error": "Model is loading, retry later"},
+            headers={"Retry-After": "5"}
+        )
+
+    # Загружаем модель вне цикла событий: загрузка не предзагруженной модели занимает минуты
+    llama = await asyncio.to_thread(get_llama, req.model)
+    inference_lock = get_inference_lock(req.model)
+
     # Формируем промпт из сообщений
     prompt_template = os.getenv("PROMPT_TEMPLATE", "bpmn")
     try:
         # Пытаемся использовать шаблон для системного сообщения
         if prompt_template:
-            tpl = env.get_template(f"{prompt_template}.tpl")
+            tpl = get_env().get_template(f"{prompt_template}.tpl")
             system_content = tpl.render()
             # Заменяем системное сообщение
             for msg in req.messages:
@@ -195,25 +292,30 @@ async def chat(
     prompt = "\n".join(f"{m.role}: {m.content}" for m in req.messages)
     logger.info(f"Запрос инференса: модель={req.model}, max_tokens={req.max_tokens}")
 
-    # Генерируем ответ
-    async def generator():
-        try:
-            for chunk in llama(
-                prompt,
-                max_tokens=req.max_tokens,
-                temperature=req.temperature,
-                stream=req.stream
-            )["choices"]:
-                content = chunk["text"]
-                # Формат ответа как у OpenAI
-                yield f"data: {json.dumps({'choices': [{'delta': {'content': content}}]})}\n\n"
+    # Генерируем ответ; обычный генератор Starlette выполняет в пуле потоков,
+    # поэтому инференс не блокирует цикл событий (и /healthz). Блокировка модели
+    # держится от изменения параметров до конца генерации
+    def generator():
+        with inference_lock:
+            # Обновляем параметры инференса
+            llama.n_ctx = req.n_ctx
+            try:
+                for chunk in llama(
+                    prompt,
+                    max_tokens=req.max_tokens,
+                    temperature=req.temperature,
+                    stream=req.stream
+                )["choices"]:
+                    content = chunk["text"]
+                    # Формат ответа как у OpenAI
+                    yield f"data: {json.dumps({'choices': [{'delta': {'content': content}}]})}\n\n"
             
-            # Сигнал завершения
-            yield "data: [DONE]\n\n"
-        except Exception as e:
-            logger.error(f"Ошибка инференса: {str(e)}")
-            yield f"data: {json.dumps({'error': str(e)})}\n\n"
-            yield "data: [DONE]\n\n"
+                # Сигнал завершения
+                yield "data: [DONE]\n\n"
+            except Exception as e:
+                logger.error(f"Ошибка инференса: {str(e)}")
+                yield f"data: {json.dumps({'error': str(e)})}\n\n"
+                yield "data: [DONE]\n\n"
 
     # Возвращаем стрим
     from fastapi.responses import StreamingResponse
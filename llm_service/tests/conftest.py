@@ -0,0 +1,6 @@
+import os
+import sys
+
+# server.py лежит в корне сервиса и читает models.json и prompts/ из рабочей директории
+SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SERVICE_DIR)
@@ -0,0 +1,74 @@
+import asyncio
+import os
+import threading
+import time
+
+import pytest
+
+httpx = pytest.importorskip("httpx")
+
+import server
+
+SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class StubLlama:
+    """Модель-заглушка, которая замечает одновременные вызовы и смену n_ctx во время генерации"""
+
+    def __init__(self):
+        self.n_ctx = 4096
+        self.active = 0
+        self.overlaps = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, prompt, **kwargs):
+        return {"choices": self.stream()}
+
+    def stream(self):
+        with self.lock:
+            self.active += 1
+            if self.active > 1:
+                self.overlaps += 1
+        n_ctx = self.n_ctx
+        try:
+            for word in ("a", "b", "c"):
+                time.sleep(0.05)
+                if self.n_ctx != n_ctx:
+                    self.overlaps += 1
+                yield {"text": word}
+        finally:
+            with self.lock:
+                self.active -= 1
+
+
+@pytest.fixture
+def llama(monkeypatch):
+    monkeypatch.chdir(SERVICE_DIR)
+    monkeypatch.setenv("PROMPT_TEMPLATE", "")
+    stub = StubLlama()
+    monkeypatch.setattr(server, "MODEL_CONFIG", {"current": "stub.gguf"})
+    monkeypatch.setattr(server, "llama_instances", {"current": stub})
+    monkeypatch.setattr(server, "inference_locks", {})
+    monkeypatch.setitem(server.startup_state, "ready", True)
+    return stub
+
+
+def test_concurrent_requests_do_not_share_model(llama):
+    async def scenario():
+        transport = httpx.ASGITransport(app=server.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            headers = {"Authorization": f"Bearer {server.API_KEY}"}
+            requests = [
+                client.post("/v1/chat/completions", headers=headers, json={
+                    "model": "current",
+                    "messages": [{"role": "user", "content": "hi"}],
+                    "n_ctx": n_ctx
+                })
+                for n_ctx in (2048, 8192)
+            ]
+            return await asyncio.gather(*requests)
+
+    responses = asyncio.run(scenario())
+    assert [r.status_code for r in responses] == [200, 200]
+    assert all(r.text.endswith("data: [DONE]\n\n") for r in responses)
+    assert llama.overlaps == 0
@@ -1,6 +1,68 @@
-from graphviz import Digraph
+import io
+import json
 from GraphWrapper import GraphWrapper
 
+# Конфигурация стилей
+DEFAULT_NODE_STYLES = {
+    'StartEvent': {'shape': 'ellipse', 'color': '#4CAF50', 'fillcolor': '#C8E6C9', 'style': 'filled'},
+    'EndEvent': {'shape': 'ellipse', 'color': '#F44336', 'fillcolor': '#FFCDD2', 'style': 'filled'},
+    'IntermediateCatchEvent': {'shape': 'ellipse', 'color': '#2196F3', 'fillcolor': '#BBDEFB', 'style': 'filled'},
+    'IntermediateThrowEvent': {'shape': 'ellipse', 'color': '#9C27B0', 'fillcolor': '#E1BEE7', 'style': 'filled'},
+    'BoundaryEvent': {'shape': 'ellipse', 'color': '#FF5722', 'fillcolor': '#FFCCBC', 'style': 'filled,dashed'},
+    'UserTask': {'shape': 'rect', 'color': '#2196F3', 'fillcolor': '#BBDEFB', 'style': 'filled,rounded'},
+    'ServiceTask': {'shape': 'rect', 'color': '#2196F3', 'fillcolor': '#BBDEFB', 'style': 'filled'},
+    'SendTask': {'shape': 'rect', 'color': '#3F51B5', 'fillcolor': '#C5CAE9', 'style': 'filled'},
+    'ReceiveTask': {'shape': 'rect', 'color': '#2196F3', 'fillcolor': '#BBDEFB', 'style': 'filled'},
+    'ManualTask': {'shape': 'rect', 'color': '#FFC107', 'fillcolor': '#FFECB3', 'style': 'filled,rounded'},
+    'BusinessRuleTask': {'shape': 'rect', 'color': '#673AB7', 'fillcolor': '#D1C4E9', 'style': 'filled'},
+    'ScriptTask': {'shape': 'rect', 'color': '#607D8B', 'fillcolor': '#CFD8DC', 'style': 'filled'},
+    'ExclusiveGateway': {'shape': 'diamond', 'color': '#9C27B0', 'fillcolor': '#E1BEE7', 'style': 'filled'},
+    'ParallelGateway': {'shape': 'diamond', 'color': '#FF9800', 'fillcolor': '#FFE0B2', 'style': 'filled'},
+    'InclusiveGateway': {'shape': 'diamond', 'color': '#8BC34A', 'fillcolor': '#DCEDC8', 'style': 'filled'},
+    'EventBasedGateway': {'shape': 'diamond', 'color': '#7B1FA2', 'fillcolor': '#CE93D8', 'style': 'filled,dashed'},
+    'SubProcess': {'shape': 'rect', 'color': '#795548', 'fillcolor': '#D7CCC8', 'style': 'filled,rounded'},
+    'CallActivity': {'shape': 'rect', 'color': '#795548', 'fillcolor': '#D7CCC8', 'style': 'filled,rounded,dashed'},
+    'TextAnnotation': {'shape': 'note', 'color': '#000000', 'fillcolor': '#FFFFFF', 'style': 'filled'}
+}
+
+DEFAULT_EDGE_STYLE = {'fontsize': '10', 'fontcolor': '#616161'}
+
+# Темы оформления: стили узлов по типам и общий стиль связей
+THEMES = {
+    'default': {'nodes': DEFAULT_NODE_STYLES, 'edge': DEFAULT_EDGE_STYLE},
+}
+
+# Кэш тем, заранее преобразованных в DOT-атрибуты
+_compiled_themes = {}
+
+def register_theme(name, node_styles, edge_style=None):
+    """Регистрация темы; отсутствующие стили берутся из темы по умолчанию"""
+    THEMES[name] = {
+        'nodes': {**DEFAULT_NODE_STYLES, **node_styles},
+        'edge': {**DEFAULT_EDGE_STYLE, **(edge_style or {})}
+    }
+    _compiled_themes.pop(name, None)
+
+def quote_dot(value):
+    """Экранирование как в graphviz.Digraph (обратные слэши, например \\l, сохраняются)"""
+    from graphviz.quoting import quote  # Ленивый импорт ускоряет запуск сервиса
+
+    return quote(str(value))
+
+def _attr_list(attrs):
+    return ' '.join(f'{key}={quote_dot(value)}' for key, value in attrs.items())
+
+def compile_theme(name):
+    if name not in _compiled_themes:
+        if name not in THEMES:
+            raise ValueError(f"Unknown theme: {name}")
+        theme = THEMES[name]
+        _compiled_themes[name] = {
+            'nodes': {node_type: _attr_list(style) for node_type, style in theme['nodes'].items()},
+            'edge': _attr_list(theme['edge'])
+        }
+    return _compiled_themes[name]
+
 def load_bpmn_data(json_data):
     """Загрузка и валидация структуры BPMN из JSON"""
     required_node_fields = ['id', 'type', 'label']
@@ -16,66 +78,71 @@ def load_bpmn_data(json_data):
     
     return json_data
 
-def create_bpmn_graph(data, filename='bpmn_graph'):
-    """Создание Graphviz графа из BPMN-описания"""
+def extract_bpmn_data(text):
+    """Извлечение графа BPMN из ответа модели (JSON может быть обёрнут в текст)"""
+    # Рассуждения модели не относятся к ответу
+    if "[REASONING_END]" in text:
+        text = text.rsplit("[REASONING_END]", 1)[1]
 
-    # Алгоритмическая доработка графа
+    start, end = text.find('{'), text.rfind('}')
+    if start == -1 or end < start:
+        raise ValueError("JSON not found in model output")
+    return load_bpmn_data(json.loads(text[start:end + 1]))
+
+def repair_bpmn_data(data):
+    """Алгоритмическая доработка графа"""
     graph = GraphWrapper()
     graph.import_from_dict(data)
     graph.check_and_add_end_events() # Исправление тупиковых узлов
     graph.check_and_add_inclusive_gateways() # Добавляем иклюзивные гейты
-    fixed_data = graph.export_to_dict()
+    return graph.export_to_dict()
 
-    # Инициализация графа
-    dot = Digraph(filename, format='png')
-    dot.attr(rankdir='LR', splines='ortho')  # Горизонтальная ориентация
-    
-    # Конфигурация стилей
-    node_styles = {
-        'StartEvent': {'shape': 'ellipse', 'color': '#4CAF50', 'fillcolor': '#C8E6C9', 'style': 'filled'},
-        'EndEvent': {'shape': 'ellipse', 'color': '#F44336', 'fillcolor': '#FFCDD2', 'style': 'filled'},
-        'IntermediateCatchEvent': {'shape': 'ellipse', 'color': '#2196F3', 'fillcolor': '#BBDEFB', 'style': 'filled'},
-        'IntermediateThrowEvent': {'shape': 'ellipse', 'color': '#9C27B0', 'fillcolor': '#E1BEE7', 'style': 'filled'},
-        'BoundaryEvent': {'shape': 'ellipse', 'color': '#FF5722', 'fillcolor': '#FFCCBC', 'style': 'filled,dashed'},
-        'UserTask': {'shape': 'rect', 'color': '#2196F3', 'fillcolor': '#BBDEFB', 'style': 'filled,rounded'},
-        'ServiceTask': {'shape': 'rect', 'color': '#2196F3', 'fillcolor': '#BBDEFB', 'style': 'filled'},
-        'SendTask': {'shape': 'rect', 'color': '#3F51B5', 'fillcolor': '#C5CAE9', 'style': 'filled'},
-        'ReceiveTask': {'shape': 'rect', 'color': '#2196F3', 'fillcolor': '#BBDEFB', 'style': 'filled'},
-        'ManualTask': {'shape': 'rect', 'color': '#FFC107', 'fillcolor': '#FFECB3', 'style': 'filled,rounded'},
-        'BusinessRuleTask': {'shape': 'rect', 'color': '#673AB7', 'fillcolor': '#D1C4E9', 'style': 'filled'},
-        'ScriptTask': {'shape': 'rect', 'color': '#607D8B', 'fillcolor': '#CFD8DC', 'style': 'filled'},
-        'ExclusiveGateway': {'shape': 'diamond', 'color': '#9C27B0', 'fillcolor': '#E1BEE7', 'style': 'filled'},
-        'ParallelGateway': {'shape': 'diamond', 'color': '#FF9800', 'fillcolor': '#FFE0B2', 'style': 'filled'},
-        'InclusiveGateway': {'shape': 'diamond', 'color': '#8BC34A', 'fillcolor': '#DCEDC8', 'style': 'filled'},
-        'EventBasedGateway': {'shape': 'diamond', 'color': '#7B1FA2', 'fillcolor': '#CE93D8', 'style': 'filled,dashed'},
-        'SubProcess': {'shape': 'rect', 'color': '#795548', 'fillcolor': '#D7CCC8', 'style': 'filled,rounded'},
-        'CallActivity': {'shape': 'rect', 'color': '#795548', 'fillcolor': '#D7CCC8', 'style': 'filled,rounded,dashed'},
-        'TextAnnotation': {'shape': 'note', 'color': '#000000', 'fillcolor': '#FFFFFF', 'style': 'filled'}
-        }   
-    
-    # Добавление узлов
+def create_bpmn_graph(data, filename='bpmn_graph', theme='default'):
+    """Создание Graphviz графа из BPMN-описания"""
+    return build_bpmn_graph(repair_bpmn_data(data), filename, theme)
+
+def build_bpmn_dot_source(fixed_data, filename='bpmn_graph', theme='default'):
+    """Генерация DOT-текста напрямую, без построения graphviz.Digraph"""
+    from graphviz.quoting import quote, quote_edge
+
+    compiled = compile_theme(theme)
+    node_styles = compiled['nodes']
+
+    out = io.StringIO()
+    write = out.write
+    write(f'digraph {quote(filename)} {{\n')
+    write('\tgraph [rankdir=LR splines=ortho]\n')  # Горизонтальная ориентация
+    write(f'\tedge [{compiled["edge"]}]\n')
+
+    # Добавление узлов (в исходном порядке: от него зависит порядок внутри рангов)
     for node in fixed_data['nodes']:
-        node_type = node['type']
-        style = node_styles.get(node_type, {})
-        
-        dot.node(
-            name=node['id'],
-            label=f"{node['label']}\n({node['id']})",
-            **style
-        )
-    
+        label = quote(f"{node['label']}\n({node['id']})")
+        style = node_styles.get(node['type'])
+        if style:
+            write(f'\t{quote(node["id"])} [label={label} {style}]\n')
+        else:
+            write(f'\t{quote(node["id"])} [label={label}]\n')
+
     # Добавление связей
     for edge in fixed_data['edges']:
         label = edge.get('label', '')
         if edge.get('condition'):
             label += f"\n[{edge['condition']}]" if label else edge['condition']
-        
-        dot.edge(
-            edge['source'],
-            edge['target'],
-            label=label,
-            fontsize='10',
-            fontcolor='#616161'
-        )
-    
-    return dot
\ No newline at end of file
+
+        write(f'\t{quote_edge(edge["source"])} -> {quote_edge(edge["target"])}')
+        if label:
+            write(f' [label={quote(label)}]')
+        write('\n')
+
+    write('}\n')
+    return out.getvalue()
+
+def build_bpmn_graph(fixed_data, filename='bpmn_graph', theme='default'):
+    """Создание Graphviz графа из уже исправленного BPMN-описания"""
+    from graphviz import Source  # Ленивый импорт ускоряет запуск сервиса
+
+    return Source(
+        build_bpmn_dot_source(fixed_data, filename, theme),
+        filename=filename,
+        format='png'
+    )
@@ -0,0 +1,247 @@
+import copy
+import json
+import os
+import threading
+import uuid
+from collections import Counter
+from GraphWrapper import (
+    GraphWrapper, unique_id, needs_end_event, needs_inclusive_gateway,
+    make_end_event, make_inclusive_gateway
+)
+
+SESSION_TTL = int(os.getenv("GRAPH_SESSIONS_TTL", "86400"))
+PATCH_RETRIES = int(os.getenv("GRAPH_SESSIONS_PATCH_RETRIES", "5"))
+
+
+class SessionNotFound(Exception):
+    pass
+
+
+def _edge_key(edge):
+    return (edge['source'], edge['target'], edge.get('label', ''), edge.get('condition', ''))
+
+
+def _take_edges(edges, counts):
+    result = []
+    for edge in edges:
+        key = _edge_key(edge)
+        if counts[key] > 0:
+            counts[key] -= 1
+            result.append(edge)
+    return result
+
+
+class GraphSession:
+    """Граф, который редактируется патчами без полной повторной обработки
+
+    Состояние сессии — граф пользователя без исправлений. Добавляемые исправлением
+    узлы (завершающие события и гейты) хранятся по узлу-владельцу; после патча
+    необходимость в них проверяется только для затронутых узлов, а id назначаются
+    заново для всех. Исправленное представление собирается из графа пользователя
+    и этих узлов и совпадает с полным исправлением (repair_bpmn_data) тех же данных,
+    в том числе когда id пользователя совпадают с id добавляемых узлов.
+    """
+
+    def __init__(self, data, end_events=None, gateways=None, version=0):
+        self.raw = GraphWrapper()
+        self.raw.import_from_dict(data)
+        self.version = version
+        self.lock = threading.Lock()
+        if end_events is None:
+            self.end_events, self.gateways = {}, {}
+            self._repair({node['id'] for node in self.raw.nodes})
+        else:
+            self.end_events, self.gateways = end_events, gateways
+        self.graph = self._build_view()
+
+    def _repair(self, node_ids):
+        """Пересчёт узлов-исправлений для node_ids по графу пользователя
+
+        Какие узлы нужны, проверяется только для node_ids. Идентификаторы же
+        зависят от порядка узлов и от всех занятых id (пользователь может занять
+        или освободить id вида endEvent_after_X), поэтому назначаются заново
+        одним линейным проходом, как при полном исправлении.
+        """
+        for node_id in node_ids:
+            self.end_events.pop(node_id, None)
+            self.gateways.pop(node_id, None)
+
+        incoming, outgoing = self.raw._degrees()
+        for node in self.raw.nodes:
+            if node['id'] in node_ids:
+                if needs_end_event(node, outgoing):
+                    self.end_events[node['id']] = None
+                if needs_inclusive_gateway(node, incoming):
+                    self.gateways[node['id']] = None
+
+        # Как и в полном исправлении: сначала завершающие события, затем гейты, в порядке узлов
+        taken = {node['id'] for node in self.raw.nodes}
+        for node in self.raw.nodes:
+            if node['id'] in self.end_events:
+                new_id = unique_id(f"endEvent_after_{node['id']}", taken)
+                taken.add(new_id)
+                self.end_events[node['id']] = make_end_event(node, new_id)
+        for node in self.raw.nodes:
+            if node['id'] in self.gateways:
+                new_id = unique_id(f"gate_before_{node['id']}", taken)
+                taken.add(new_id)
+                self.gateways[node['id']] = make_inclusive_gateway(node, new_id)
+
+    def _build_view(self):
+        """Исправленный граф в том же порядке узлов и связей, что и полное исправление"""
+        graph = GraphWrapper()
+        order = [node['id'] for node in self.raw.nodes]
+        ends = [(i, self.end_events[i]) for i in order if i in self.end_events]
+        gates = [(i, self.gateways[i]) for i in order if i in self.gateways]
+
+        nodes = [dict(node) for node in self.raw.nodes]
+        nodes += [dict(node) for _, node in ends]
+        nodes += [dict(node) for _, node in gates]
+
+        edges = []
+        for edge in self.raw.edges:
+            edge = dict(edge)
+            if edge['target'] in self.gateways:
+                edge['target'] = self.gateways[edge['target']]['id']
+            edges.append(edge)
+        edges += [{'source': owner, 'target': node['id']} for owner, node in ends]
+        edges += [{'source': node['id'], 'target': owner} for owner, node in gates]
+
+        graph.import_from_dict({'nodes': nodes, 'edges': edges})
+        return graph
+
+    def apply(self, ops):
+        """Применение списка операций; возвращает разницу с предыдущей версией"""
+        with self.lock:
+            view_nodes_before = {n['id']: n for n in self.graph.nodes}
+            view_edges_before = self.graph.edges
+            raw_nodes = [dict(n) for n in self.raw.nodes]
+            raw_edges = [dict(e) for e in self.raw.edges]
+
+            try:
+                affected = set()
+                for op in ops:
+                    affected |= self._apply_op(op)
+            except (KeyError, TypeError, ValueError):
+                # Откат к состоянию до патча
+                self.raw.nodes = raw_nodes
+                self.raw.edges = raw_edges
+                raise
+
+            # Пересчитываем исправления только для затронутой окрестности
+            self._repair(affected)
+            self.graph = self._build_view()
+            self.version += 1
+            return self._diff(view_nodes_before, view_edges_before)
+
+    def _apply_op(self, op):
+        kind = op['op']
+        graph = self.raw
+        if kind == 'add_node':
+            node = op['node']
+            if not all(field in node for field in ('id', 'type', 'label')):
+                raise ValueError("Invalid node format")
+            return graph.add_node(dict(node))
+        if kind == 'remove_node':
+            return graph.remove_node(op['id'])
+        if kind == 'relabel_node':
+            return graph.relabel_node(op['id'], op['label'])
+        if kind == 'add_edge':
+            return graph.add_edge(dict(op['edge']))
+        if kind == 'remove_edge':
+            return graph.remove_edge(op['source'], op['target'])
+        if kind == 'reconnect_edge':
+            return graph.reconnect_edge(
+                op['source'], op['target'],
+                op.get('new_source'), op.get('new_target')
+            )
+        raise ValueError(f"Unknown operation: {kind}")
+
+    def _diff(self, nodes_before, edges_before):
+        nodes_after = {n['id']: n for n in self.graph.nodes}
+        edges_removed = Counter(map(_edge_key, edges_before))
+        edges_added = Counter(map(_edge_key, self.graph.edges))
+        edges_removed, edges_added = edges_removed - edges_added, edges_added - edges_removed
+
+        return {
+            'version': self.version,
+            'added_nodes': [n for i, n in nodes_after.items() if i not in nodes_before],
+            'removed_nodes': [i for i in nodes_before if i not in nodes_after],
+            'changed_nodes': [n for i, n in nodes_after.items()
+                              if i in nodes_before and nodes_before[i] != n],
+            'added_edges': _take_edges(self.graph.edges, edges_added),
+            'removed_edges': _take_edges(edges_before, edges_removed),
+        }
+
+    def export_to_dict(self):
+        with self.lock:
+            return copy.deepcopy(self.graph.export_to_dict())
+
+    def dump(self):
+        """Состояние для хранилища: граф пользователя и узлы-исправления"""
+        return {
+            'version': self.version,
+            'graph': self.raw.export_to_dict(),
+            'end_events': self.end_events,
+            'gateways': self.gateways
+        }
+
+    @classmethod
+    def load(cls, state):
+        return cls(state['graph'], state['end_events'], state['gateways'], state['version'])
+
+
+class GraphSessionStore:
+    """Сессии редактирования в общем хранилище, доступном всем воркерам"""
+
+    def __init__(self, store, ttl=SESSION_TTL):
+        self.store = store
+        self.ttl = ttl
+
+    def _key(self, session_id):
+        return f"graph_session:{session_id}"
+
+    def _dump(self, session):
+        return json.dumps(session.dump(), ensure_ascii=False)
+
+    def _load(self, value):
+        return GraphSession.load(json.loads(value))
+
+    def create(self, data):
+        session = GraphSession(copy.deepcopy(data))
+        session_id = uuid.uuid4().hex
+        self.store.set(self._key(session_id), self._dump(session), self.ttl)
+        return session_id, session
+
+    def get(self, session_id):
+        value = self.store.get(self._key(session_id))
+        return None if value is None else self._load(value)
+
+    def apply(self, session_id, ops):
+        """Применение патча с оптимистичной блокировкой
+
+        Разбор, патч и сериализация выполняются вне транзакции; запись проходит,
+        только если сессию за это время никто не изменил, иначе патч повторяется.
+        После PATCH_RETRIES неудач патч применяется под блокировкой хранилища.
+        """
+        key = self._key(session_id)
+        for _ in range(PATCH_RETRIES):
+            value = self.store.get(key)
+            if value is None:
+                raise SessionNotFound(session_id)
+            session = self._load(value)
+            diff = session.apply(ops)
+            if self.store.compare_and_set(key, value, self._dump(session), self.ttl):
+                return session, diff
+
+        def patch(value):
+            if value is None:
+                raise SessionNotFound(session_id)
+            session = self._load(value)
+            diff = session.apply(ops)
+            return self._dump(session), (session, diff)
+
+        return self.store.update(key, patch, self.ttl)
+
+    def delete(self, session_id):
+        return self.store.delete(self._key(session_id))
@@ -1,3 +1,45 @@
+def unique_id(base_id, existing_ids):
+    new_id = base_id
+    counter = 1
+    while new_id in existing_ids:
+        new_id = f"{base_id}_{counter}"
+        counter += 1
+    return new_id
+
+
+def needs_end_event(node, outgoing):
+    """Тупиковый узел (кроме EndEvent) получает завершающее событие"""
+    return node['type'] != 'EndEvent' and not outgoing.get(node['id'])
+
+
+def needs_inclusive_gateway(node, incoming):
+    """Узел с несколькими входящими связями получает гейт перед собой"""
+    return incoming.get(node['id'], 0) > 1
+
+
+def _same_parent(node, new_node):
+    # Добавленный узел вложен в тот же подпроцесс, что и узел-владелец
+    if 'parent' in node:
+        new_node['parent'] = node['parent']
+    return new_node
+
+
+def make_end_event(node, new_id):
+    return _same_parent(node, {
+        'id': new_id,
+        'type': 'EndEvent',
+        'label': f"Завершение после {node['label']}"
+    })
+
+
+def make_inclusive_gateway(node, new_id):
+    return _same_parent(node, {
+        "id": new_id,
+        "type": "InclusiveGateway",
+        "label": f"Гейт перед {node['label']}"
+    })
+
+
 class GraphWrapper:
     def __init__(self):
         self.nodes = []
@@ -10,6 +52,153 @@ class GraphWrapper:
     def export_to_dict(self):
         return {'nodes': self.nodes, 'edges': self.edges}
 
+    def get_node(self, node_id):
+        for node in self.nodes:
+            if node['id'] == node_id:
+                return node
+        return None
+
+    def _unique_id(self, base_id):
+        return unique_id(base_id, {n['id'] for n in self.nodes})
+
+    def _degrees(self):
+        incoming, outgoing = {}, {}
+        for edge in self.edges:
+            outgoing[edge['source']] = outgoing.get(edge['source'], 0) + 1
+            incoming[edge['target']] = incoming.get(edge['target'], 0) + 1
+        return incoming, outgoing
+
+    def neighborhood(self, node_ids):
+        """Узлы из node_ids вместе с их непосредственными соседями"""
+        node_ids = set(node_ids)
+        result = set(node_ids)
+        for edge in self.edges:
+            if edge['source'] in node_ids:
+                result.add(edge['target'])
+            if edge['target'] in node_ids:
+                result.add(edge['source'])
+        return result
+
+    def adjacency(self):
+        adjacency = {node['id']: [] for node in self.nodes}
+        for edge in self.edges:
+            if edge['source'] in adjacency and edge['target'] in adjacency:
+                adjacency[edge['source']].append(edge['target'])
+        return adjacency
+
+    def strongly_connected_components(self):
+        """Компоненты сильной связности (алгоритм Тарьяна, без рекурсии)
+
+        Компоненты возвращаются в топологическом порядке графа конденсации.
+        """
+        adjacency = self.adjacency()
+        index, lowlink = {}, {}
+        stack, on_stack = [], set()
+        components = []
+        counter = 0
+
+        for root in adjacency:
+            if root in index:
+                continue
+            work = [(root, iter(adjacency[root]))]
+            index[root] = lowlink[root] = counter
+            counter += 1
+            stack.append(root)
+            on_stack.add(root)
+
+            while work:
+                node_id, successors = work[-1]
+                for successor in successors:
+                    if successor not in index:
+                        index[successor] = lowlink[successor] = counter
+                        counter += 1
+                        stack.append(successor)
+                        on_stack.add(successor)
+                        work.append((successor, iter(adjacency[successor])))
+                        break
+                    if successor in on_stack:
+                        lowlink[node_id] = min(lowlink[node_id], index[successor])
+                else:
+                    work.pop()
+                    if work:
+                        parent = work[-1][0]
+                        lowlink[parent] = min(lowlink[parent], lowlink[node_id])
+                    if lowlink[node_id] == index[node_id]:
+                        component = []
+                        while True:
+                            member = stack.pop()
+                            on_stack.discard(member)
+                            component.append(member)
+                            if member == node_id:
+                                break
+                        components.append(component)
+
+        components.reverse()
+        return components
+
+    # Операции редактирования (используются сессиями редактора)
+
+    def add_node(self, node):
+        if self.get_node(node['id']) is not None:
+            raise ValueError(f"Node ID {node['id']} already exists")
+        self.nodes.append(node)
+        return {node['id']}
+
+    def remove_node(self, node_id):
+        if self.get_node(node_id) is None:
+            raise ValueError(f"Node {node_id} not found")
+        affected = self.neighborhood([node_id])
+        self.nodes = [n for n in self.nodes if n['id'] != node_id]
+        self.edges = [e for e in self.edges
+                      if e['source'] != node_id and e['target'] != node_id]
+        return affected
+
+    def relabel_node(self, node_id, label):
+        node = self.get_node(node_id)
+        if node is None:
+            raise ValueError(f"Node {node_id} not found")
+        node['label'] = label
+        return {node_id}
+
+    def add_edge(self, edge):
+        for field in ('source', 'target'):
+            if self.get_node(edge[field]) is None:
+                raise ValueError(f"Node {edge[field]} not found")
+        self.edges.append(edge)
+        return {edge['source'], edge['target']}
+
+    def reconnect_edge(self, source, target, new_source=None, new_target=None):
+        for edge in self.edges:
+            if edge['source'] == source and edge['target'] == target:
+                break
+        else:
+            raise ValueError(f"Edge {source} -> {target} not found")
+
+        for node_id in (new_source, new_target):
+            if node_id is not None and self.get_node(node_id) is None:
+                raise ValueError(f"Node {node_id} not found")
+
+        affected = {source, target}
+        if new_source is not None:
+            edge['source'] = new_source
+            affected.add(new_source)
+        if new_target is not None:
+            edge['target'] = new_target
+            affected.add(new_target)
+        return affected
+
+    def remove_edge(self, source, target):
+        for i, edge in enumerate(self.edges):
+            if edge['source'] == source and edge['target'] == target:
+                del self.edges[i]
+                return {source, target}
+        raise ValueError(f"Edge {source} -> {target} not found")
+
+    def repair(self):
+        """Запуск всех проходов исправления"""
+        self.check_and_add_end_events()
+        self.check_and_add_inclusive_gateways()
+
     def add_node_before(self, target_node_id, new_node):
         if not any(node['id'] == target_node_id for node in self.nodes):
             raise ValueError(f"Target node {target_node_id} not found")
@@ -29,27 +218,13 @@ class GraphWrapper:
         })
 
     def check_and_add_end_events(self):
-        nodes_to_process = []
-        for node in self.nodes:
-            node_id = node['id']
-            if (node['type'] != 'EndEvent' and 
-                not any(edge['source'] == node_id for edge in self.edges)):
-                nodes_to_process.append(node)
+        _, outgoing = self._degrees()
+        nodes_to_process = [node for node in self.nodes if needs_end_event(node, outgoing)]
         
         for node in nodes_to_process:
-            base_id = f"endEvent_after_{node['id']}"
-            new_end_id = base_id
-            counter = 1
-            
-            while any(n['id'] == new_end_id for n in self.nodes):
-                new_end_id = f"{base_id}_{counter}"
-                counter += 1
+            new_end_id = self._unique_id(f"endEvent_after_{node['id']}")
             
-            new_end_node = {
-                'id': new_end_id,
-                'type': 'EndEvent',
-                'label': f"Завершение после {node['label']}"
-            }
+            new_end_node = make_end_event(node, new_end_id)
             self.nodes.append(new_end_node)
             
             self.edges.append({
@@ -59,29 +234,16 @@ class GraphWrapper:
     
     def check_and_add_inclusive_gateways(self):
         # Собираем узлы с несколькими входящими связями
-        nodes_to_process = []
-        for node in self.nodes:
-            incoming_edges = sum(1 for edge in self.edges if edge["target"] == node["id"])
-            if incoming_edges > 1:
-                nodes_to_process.append(node)
+        incoming, _ = self._degrees()
+        nodes_to_process = [node for node in self.nodes if needs_inclusive_gateway(node, incoming)]
 
         # Добавляем гейтвей для каждого найденного узла
         for node in nodes_to_process:
-            base_id = f"gate_before_{node['id']}"
-            new_id = base_id
-            counter = 1
-            
             # Генерация уникального ID
-            while any(n["id"] == new_id for n in self.nodes):
-                new_id = f"{base_id}_{counter}"
-                counter += 1
+            new_id = self._unique_id(f"gate_before_{node['id']}")
 
             # Создаем новый InclusiveGateway
-            new_gate = {
-                "id": new_id,
-                "type": "InclusiveGateway",
-                "label": f"Гейт перед {node['label']}"
-            }
+            new_gate = make_inclusive_gateway(node, new_id)
             
             # Добавляем узел перед текущим
             try:
@@ -0,0 +1,179 @@
+import os
+from GraphWrapper import GraphWrapper
+import GraphCreator as GC
+
+MAX_CLUSTER_SIZE = int(os.getenv("MAX_CLUSTER_SIZE", "200"))
+
+# Типы узлов, которые могут содержать вложенные узлы: у вложенного узла
+# необязательное поле 'parent' содержит id контейнера
+CONTAINER_TYPES = ('SubProcess', 'CallActivity')
+
+
+def partition_graph(data, max_cluster_size=MAX_CLUSTER_SIZE):
+    """Разбиение графа на кластеры для независимой раскладки
+
+    Узел с полем 'parent' (id узла SubProcess/CallActivity) попадает в кластер
+    своего контейнера; вложенные контейнеры раскладываются вместе с внешним,
+    поэтому кластер строится по контейнеру верхнего уровня. Остальные узлы
+    объединяются в компоненты сильной связности, которые в топологическом
+    порядке упаковываются в кластеры не больше max_cluster_size.
+    Идентификаторы кластеров не совпадают с идентификаторами узлов.
+    """
+    nodes_by_id = {node['id']: node for node in data['nodes']}
+
+    clusters = []
+    assigned = set()
+
+    # Кластеры по вложенности в подпроцессы
+    members_by_root = {}
+    for node in data['nodes']:
+        root = _container_root(node, nodes_by_id)
+        if root is not None:
+            members_by_root.setdefault(root, [root])
+            if node['id'] != root:
+                members_by_root[root].append(node['id'])
+    for root, members in members_by_root.items():
+        # Узлы уже занятого кластера пропускаем (бывает при цикле в полях parent)
+        members = [m for m in members if m not in assigned]
+        if len(members) <= 1:
+            continue  # Пустой контейнер раскладывается как обычный узел
+        assigned.update(members)
+        clusters.append({
+            'id': f"cluster_{root}",
+            'label': nodes_by_id[root]['label'],
+            'nodes': members
+        })
+
+    # Остальные узлы: упаковка компонент сильной связности по порядку
+    graph = GraphWrapper()
+    graph.import_from_dict({
+        'nodes': [n for n in data['nodes'] if n['id'] not in assigned],
+        'edges': data['edges']
+    })
+    current = []
+    for component in graph.strongly_connected_components():
+        if current and len(current) + len(component) > max_cluster_size:
+            clusters.append(_chunk_cluster(current, nodes_by_id))
+            current = []
+        current.extend(component)
+    if current:
+        clusters.append(_chunk_cluster(current, nodes_by_id))
+
+    # Уникальные идентификаторы кластеров: свёрнутый кластер показывается узлом
+    # рядом с обычными узлами, поэтому совпадать с ними он не должен
+    used_ids = set(nodes_by_id)
+    for i, cluster in enumerate(clusters):
+        cluster_id = cluster['id'] or f"cluster_{i}"
+        while cluster_id in used_ids:
+            cluster_id += "_"
+        cluster['id'] = cluster_id
+        used_ids.add(cluster_id)
+    return clusters
+
+
+def _container_root(node, nodes_by_id):
+    """Контейнер верхнего уровня, в который вложен узел (или сам узел-контейнер)"""
+    root = node['id'] if node['type'] in CONTAINER_TYPES else None
+    seen = {node['id']}
+    parent = node.get('parent')
+    while parent in nodes_by_id and parent not in seen \
+            and nodes_by_id[parent]['type'] in CONTAINER_TYPES:
+        root = parent
+        seen.add(parent)
+        parent = nodes_by_id[parent].get('parent')
+    return root
+
+
+def _chunk_cluster(members, nodes_by_id):
+    first = nodes_by_id[members[0]]['label']
+    return {
+        'id': None,
+        'label': f"{first} … (узлов: {len(members)})" if len(members) > 1 else first,
+        'nodes': members
+    }
+
+
+def _cluster_index(clusters):
+    return {node_id: cluster['id'] for cluster in clusters for node_id in cluster['nodes']}
+
+
+def _cluster_edges(data, membership):
+    """Связи между кластерами (по одной на пару, с числом исходных связей)"""
+    counts = {}
+    for edge in data['edges']:
+        source = membership.get(edge['source'])
+        target = membership.get(edge['target'])
+        if source is None or target is None or source == target:
+            continue
+        counts[(source, target)] = counts.get((source, target), 0) + 1
+    return [
+        {'source': source, 'target': target, 'label': str(count) if count > 1 else ''}
+        for (source, target), count in counts.items()
+    ]
+
+
+def collapsed_data(data, clusters):
+    """Верхний уровень: каждый кластер показан одним узлом SubProcess"""
+    membership = _cluster_index(clusters)
+    nodes = [
+        {'id': cluster['id'], 'type': 'SubProcess', 'label': cluster['label']}
+        for cluster in clusters
+    ]
+    return {'nodes': nodes, 'edges': _cluster_edges(data, membership)}
+
+
+def cluster_data(data, clusters, cluster_id, with_neighbours=True):
+    """Содержимое одного кластера; соседние кластеры показаны свёрнутыми"""
+    membership = _cluster_index(clusters)
+    cluster = next((c for c in clusters if c['id'] == cluster_id), None)
+    if cluster is None:
+        raise ValueError(f"Cluster {cluster_id} not found")
+
+    members = set(cluster['nodes'])
+    nodes = [node for node in data['nodes'] if node['id'] in members]
+    edges = []
+    neighbours = {}
+    for edge in data['edges']:
+        source_inside = edge['source'] in members
+        target_inside = edge['target'] in members
+        if source_inside and target_inside:
+            edges.append(edge)
+        elif with_neighbours and (source_inside or target_inside):
+            # Связь с другим кластером ведёт к его свёрнутому узлу
+            outside = edge['target'] if source_inside else edge['source']
+            neighbour = membership.get(outside)
+            if neighbour is None:
+                continue
+            neighbours[neighbour] = True
+            edges.append({
+                'source': edge['source'] if source_inside else neighbour,
+                'target': neighbour if source_inside else edge['target'],
+                'label': edge.get('label', '')
+            })
+
+    labels = {c['id']: c['label'] for c in clusters}
+    nodes += [
+        {'id': neighbour, 'type': 'SubProcess', 'label': labels[neighbour]}
+        for neighbour in neighbours
+    ]
+    return {'nodes': nodes, 'edges': edges}
+
+
+def composed_dot_source(data, clusters, image_paths, filename='bpmn_graph'):
+    """DOT-текст, собирающий заранее отрисованные кластеры в одну схему"""
+    membership = _cluster_index(clusters)
+    lines = [
+        f'digraph {GC.quote_dot(filename)} {{',
+        '\tgraph [rankdir=LR splines=ortho]',
+        '\tnode [shape=none label=""]',
+        '\tedge [fontsize="10" fontcolor="#616161"]'
+    ]
+    for cluster in clusters:
+        lines.append(
+            f'\t{GC.quote_dot(cluster["id"])} [image={GC.quote_dot(image_paths[cluster["id"]])}]'
+        )
+    for edge in _cluster_edges(data, membership):
+        attrs = f' [xlabel={GC.quote_dot(edge["label"])}]' if edge['label'] else ''
+        lines.append(f'\t{GC.quote_dot(edge["source"])} -> {GC.quote_dot(edge["target"])}{attrs}')
+    lines.append('}')
+    return '\n'.join(lines) + '\n'
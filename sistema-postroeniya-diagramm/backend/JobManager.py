@@ -0,0 +1,313 @@
+import json
+import os
+import threading
+import time
+import uuid
+import GraphCreator as GC
+from llm_interface import DeepSeekLLM, StreamFormatter
+from SharedStore import hash_api_key, make_llm_key
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+JOB_MAX_PER_KEY = int(os.getenv("JOB_MAX_PER_KEY", "2"))
+JOB_TTL = int(os.getenv("JOB_TTL", "604800"))
+JOB_FLUSH_INTERVAL = float(os.getenv("JOB_FLUSH_INTERVAL", "0.5"))
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "1.0"))
+JOB_STALE_AFTER = float(os.getenv("JOB_STALE_AFTER", "300"))
+# Приоритет задачи от 0 до JOB_MAX_PRIORITY: небольшой диапазон не позволяет
+# одному клиенту бесконечно обгонять задачи остальных
+JOB_MAX_PRIORITY = int(os.getenv("JOB_MAX_PRIORITY", "3"))
+LLM_CACHE_TTL = int(os.getenv("LLM_CACHE_TTL", "86400"))
+
+# Модель для каждого вида задач
+JOB_MODELS = {
+    'formalize': 'v3',
+    'generate': 'r1'
+}
+
+FINAL_STATUSES = ('done', 'error', 'cancelled')
+
+# Очередь и выполняющиеся задачи всех воркеров
+SCHEDULER_KEY = "jobs:scheduler"
+
+
+class JobCancelled(Exception):
+    """Задача отменена (или удалена) и больше не должна изменяться воркером"""
+    pass
+
+
+class JobOutput:
+    """Приёмник событий генерации с периодическим сохранением частичного вывода
+
+    Передаётся в llm.generate() вместо queue.Queue.
+    """
+
+    def __init__(self, manager, job_id):
+        self.manager = manager
+        self.job_id = job_id
+        self.formatter = StreamFormatter()
+        self.chunks = []
+        self.finished = False
+        self.cancelled = False
+        self.error = None
+        self.last_flush = time.monotonic()
+
+    def put(self, item):
+        if self.cancelled:
+            raise JobCancelled(self.job_id)
+
+        if item["type"] in ("content", "reasoning"):
+            self.chunks.extend(self.formatter.format(item))
+        elif item["type"] == "error":
+            self.error = item['data']
+        elif item["type"] == "end":
+            self.finished = True
+
+        if time.monotonic() - self.last_flush >= JOB_FLUSH_INTERVAL:
+            self.flush()
+
+    def flush(self):
+        # Проверка статуса и запись в одной транзакции: отмена из другого воркера не затирается
+        try:
+            self.manager.update(self.job_id, {'output': "".join(self.chunks)}, expected=('running',))
+        except JobCancelled:
+            self.cancelled = True
+            raise
+        self.last_flush = time.monotonic()
+
+
+class JobManager:
+    """Фоновые задачи генерации: пул воркеров с приоритетами и лимитом на API-ключ
+
+    Состояние задач, очередь и список выполняющихся задач хранятся в общем
+    хранилище: задачу может взять воркер любого процесса, лимиты workers
+    и max_per_key действуют на все процессы вместе, а клиент может
+    переподключиться к потоку в любой момент.
+    """
+
+    def __init__(self, store, workers=JOB_WORKERS, max_per_key=JOB_MAX_PER_KEY):
+        self.store = store
+        self.workers = workers
+        self.max_per_key = max_per_key
+        self.condition = threading.Condition()
+        self.threads = []
+
+    def _key(self, job_id):
+        return f"job:{job_id}"
+
+    def _request_key(self, job_id):
+        # Промпт и API-ключ хранятся отдельно от состояния, которое отдаётся клиенту
+        return f"job_request:{job_id}"
+
+    def save(self, job_id, state):
+        self.store.set_json(self._key(job_id), state, JOB_TTL)
+
+    def get(self, job_id):
+        return self.store.get_json(self._key(job_id))
+
+    def update(self, job_id, changes, expected=('queued', 'running')):
+        """Атомарное изменение задачи, если её статус входит в expected
+
+        Иначе (в том числе если задачи нет) ничего не записывается
+        и выбрасывается JobCancelled.
+        """
+        def change(value):
+            state = None if value is None else json.loads(value)
+            if state is None or state['status'] not in expected:
+                raise JobCancelled(job_id)
+            state.update(changes)
+            state['updated_at'] = time.time()
+            return json.dumps(state, ensure_ascii=False), state
+
+        return self.store.update(self._key(job_id), change, JOB_TTL)
+
+    def is_stale(self, state):
+        """Задача числится выполняющейся, но её воркер давно не сохранял вывод"""
+        return (state['status'] == 'running'
+                and time.time() - state.get('updated_at', state['created_at']) > JOB_STALE_AFTER)
+
+    def submit(self, kind, prompt, api_key, priority=0):
+        if kind not in JOB_MODELS:
+            raise ValueError(f"Unknown job kind: {kind}")
+        if not 0 <= priority <= JOB_MAX_PRIORITY:
+            raise ValueError(f"Priority must be between 0 and {JOB_MAX_PRIORITY}")
+
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        state = {
+            'id': job_id,
+            'kind': kind,
+            'status': 'queued',
+            'priority': priority,
+            'created_at': now,
+            'updated_at': now,
+            'output': '',
+            'graph': None,
+            'error': None
+        }
+        self.store.set_json(self._request_key(job_id), {'prompt': prompt, 'api_key': api_key}, JOB_TTL)
+        self.save(job_id, state)
+
+        entry = {'id': job_id, 'owner': hash_api_key(api_key), 'priority': priority, 'created_at': now}
+        self._update_scheduler(lambda scheduler: self._enqueue(scheduler, entry))
+        self.start()
+        return state
+
+    def cancel(self, job_id):
+        try:
+            state = self.update(job_id, {'status': 'cancelled', 'finished_at': time.time()})
+        except JobCancelled:
+            # Задачи нет или она уже завершена
+            return self.get(job_id)
+
+        # Задача из очереди больше не будет выбрана; выполняющаяся остановится
+        # при следующем сохранении вывода
+        def dequeue(scheduler):
+            scheduler['queued'] = [e for e in scheduler['queued'] if e['id'] != job_id]
+
+        self._update_scheduler(dequeue)
+        return state
+
+    def start(self):
+        """Запуск воркеров процесса (при старте сервиса или с первой задачей)"""
+        with self.condition:
+            while len(self.threads) < self.workers:
+                thread = threading.Thread(target=self._worker, daemon=True)
+                thread.start()
+                self.threads.append(thread)
+            self.condition.notify_all()
+
+    @staticmethod
+    def _enqueue(scheduler, entry):
+        # Меньший ключ в начале списка: высокий приоритет, затем порядок поступления
+        scheduler['queued'].append(entry)
+        scheduler['queued'].sort(key=lambda e: (-e['priority'], e['created_at']))
+
+    def _update_scheduler(self, fn):
+        def change(value):
+            scheduler = json.loads(value) if value is not None else {'queued': [], 'running': {}}
+            result = fn(scheduler)
+            return json.dumps(scheduler, ensure_ascii=False), result
+
+        return self.store.update(SCHEDULER_KEY, change)
+
+    def _claim(self):
+        """Выбор задачи из общей очереди с учётом общего лимита и лимита на владельца"""
+        scheduler = self.store.get_json(SCHEDULER_KEY)
+        if not scheduler or not scheduler['queued']:
+            return None
+
+        def claim(scheduler):
+            running = scheduler['running']
+            if len(running) >= self.workers:
+                return None
+            counts = {}
+            for item in running.values():
+                counts[item['owner']] = counts.get(item['owner'], 0) + 1
+            # Первая по приоритету задача, владелец которой не превысил лимит
+            for entry in scheduler['queued']:
+                if counts.get(entry['owner'], 0) < self.max_per_key:
+                    scheduler['queued'].remove(entry)
+                    running[entry['id']] = {**entry, 'claimed_at': time.time()}
+                    return entry['id']
+            return None
+
+        return self._update_scheduler(claim)
+
+    def _release(self, job_id, requeue=False):
+        def release(scheduler):
+            item = scheduler['running'].pop(job_id, None)
+            if requeue and item is not None:
+                item.pop('claimed_at')
+                self._enqueue(scheduler, item)
+
+        self._update_scheduler(release)
+        with self.condition:
+            self.condition.notify_all()
+
+    def _reap_stale(self):
+        """Освобождение мест задач, воркер которых остановился (например, при перезапуске процесса)"""
+        scheduler = self.store.get_json(SCHEDULER_KEY)
+        if not scheduler:
+            return
+        now = time.time()
+        for job_id, item in scheduler['running'].items():
+            if now - item['claimed_at'] <= JOB_STALE_AFTER:
+                continue
+            state = self.get(job_id)
+            if state is not None and state['status'] == 'queued':
+                # Воркер остановился, не успев начать задачу: возвращаем её в очередь
+                self._release(job_id, requeue=True)
+            elif state is None or state['status'] in FINAL_STATUSES or self.is_stale(state):
+                try:
+                    self.update(job_id, {'status': 'error', 'error': "Worker stopped", 'finished_at': now},
+                                expected=('running',))
+                except JobCancelled:
+                    pass
+                self._release(job_id)
+
+    def _worker(self):
+        while True:
+            job_id = self._claim()
+            if job_id is None:
+                self._reap_stale()
+                with self.condition:
+                    self.condition.wait(JOB_POLL_INTERVAL)
+                continue
+            try:
+                self._run(job_id)
+            finally:
+                self._release(job_id)
+
+    def _run(self, job_id):
+        request = self.store.get_json(self._request_key(job_id))
+        try:
+            if request is None:
+                self.update(job_id, {'status': 'error', 'error': "Job request expired"})
+                return
+            state = self.update(job_id, {'status': 'running', 'started_at': time.time()},
+                                expected=('queued',))
+        except JobCancelled:
+            return
+
+        try:
+            self._generate(job_id, state, request)
+        finally:
+            self.store.delete(self._request_key(job_id))
+
+    def _generate(self, job_id, state, request):
+        llm = DeepSeekLLM(api_key=request['api_key'], model=JOB_MODELS[state['kind']])
+        prompt = request['prompt']
+
+        cache_key = make_llm_key(llm.model, prompt, request['api_key'])
+        cached = self.store.get(cache_key)
+        output = JobOutput(self, job_id)
+        if cached is not None:
+            output.chunks.append(cached.decode('utf-8'))
+            output.finished = True
+        else:
+            try:
+                llm.generate(prompt, output)
+            except JobCancelled:
+                pass
+            if output.cancelled:
+                return
+
+        changes = {'output': "".join(output.chunks), 'finished_at': time.time()}
+        if output.error is not None or not output.finished:
+            changes['status'] = 'error'
+            changes['error'] = output.error or "Generation interrupted"
+        else:
+            changes['status'] = 'done'
+            if cached is None and output.chunks:
+                self.store.set(cache_key, changes['output'].encode('utf-8'), LLM_CACHE_TTL)
+            if state['kind'] == 'formalize':
+                try:
+                    changes['graph'] = GC.extract_bpmn_data(changes['output'])
+                except (KeyError, TypeError, ValueError) as e:
+                    changes['error'] = f"Graph extraction failed: {str(e)}"
+
+        # Отмена, пришедшая во время генерации, не перезаписывается результатом
+        try:
+            self.update(job_id, changes, expected=('running',))
+        except JobCancelled:
+            pass
@@ -0,0 +1,126 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+STORE_PATH = os.getenv("SHARED_STORE_PATH", "shared_store.sqlite3")
+PRUNE_EVERY = 500
+
+
+def make_key(namespace, *parts):
+    """Ключ кэша из канонического JSON-представления частей"""
+    raw = json.dumps(parts, sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+    return f"{namespace}:{hashlib.sha256(raw.encode('utf-8')).hexdigest()}"
+
+
+def hash_api_key(api_key):
+    """Владелец запроса: хэш API-ключа (сам ключ в хранилище не попадает)"""
+    return hashlib.sha256(api_key.encode('utf-8')).hexdigest()
+
+
+def make_llm_key(model, prompt, api_key):
+    """Ключ ответа модели в пределах одного API-ключа
+
+    Промпты, отличающиеся только пробелами, считаются одинаковыми.
+    """
+    return make_key("llm", hash_api_key(api_key), model, " ".join(prompt.split()))
+
+
+class SharedStore:
+    """Хранилище ключ-значение в SQLite (WAL), общее для всех воркеров
+
+    Каждый поток открывает своё соединение; запись между процессами
+    сериализуется блокировкой SQLite, поэтому несколько воркеров uvicorn
+    или контейнеров с общим томом видят одни и те же данные.
+    """
+
+    def __init__(self, path=STORE_PATH):
+        self.path = path
+        self.local = threading.local()
+        self.writes = 0
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS kv ("
+                "key TEXT PRIMARY KEY, value BLOB NOT NULL, expires_at REAL)"
+            )
+
+    def _connect(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self.local.conn = conn
+        return conn
+
+    def get(self, key):
+        row = self._connect().execute(
+            "SELECT value, expires_at FROM kv WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None or (row[1] is not None and row[1] < time.time()):
+            return None
+        return row[0]
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.time() + ttl if ttl else None
+        self._connect().execute(
+            "INSERT OR REPLACE INTO kv (key, value, expires_at) VALUES (?, ?, ?)",
+            (key, value, expires_at)
+        )
+        self._maybe_prune()
+
+    def delete(self, key):
+        cursor = self._connect().execute("DELETE FROM kv WHERE key = ?", (key,))
+        return cursor.rowcount > 0
+
+    def update(self, key, fn, ttl=None):
+        """Атомарное чтение-изменение-запись: fn(старое значение) -> (новое значение, результат)"""
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT value, expires_at FROM kv WHERE key = ?", (key,)
+            ).fetchone()
+            current = None
+            if row is not None and (row[1] is None or row[1] >= time.time()):
+                current = row[0]
+            value, result = fn(current)
+            expires_at = time.time() + ttl if ttl else None
+            conn.execute(
+                "INSERT OR REPLACE INTO kv (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, value, expires_at)
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return result
+
+    def compare_and_set(self, key, expected, value, ttl=None):
+        """Запись value, только если текущее значение равно expected; True при успехе
+
+        Одна инструкция UPDATE: блокировка записи держится только на время её выполнения.
+        """
+        expires_at = time.time() + ttl if ttl else None
+        cursor = self._connect().execute(
+            "UPDATE kv SET value = ?, expires_at = ? WHERE key = ? AND value = ?",
+            (value, expires_at, key, expected)
+        )
+        return cursor.rowcount > 0
+
+    def get_json(self, key):
+        value = self.get(key)
+        return None if value is None else json.loads(value)
+
+    def set_json(self, key, value, ttl=None):
+        self.set(key, json.dumps(value, ensure_ascii=False), ttl)
+
+    def _maybe_prune(self):
+        # Периодически удаляем просроченные записи
+        self.writes += 1
+        if self.writes % PRUNE_EVERY == 0:
+            self._connect().execute(
+                "DELETE FROM kv WHERE expires_at IS NOT NULL AND expires_at < ?", (time.time(),)
+            )
@@ -0,0 +1,87 @@
+import asyncio
+
+
+class SingleFlight:
+    """Объединение одновременных одинаковых вычислений в одно
+
+    Пока вычисление с ключом key выполняется, остальные вызовы с тем же ключом
+    ждут его результата. Отключение одного клиента не отменяет вычисление
+    для остальных.
+    """
+
+    def __init__(self):
+        self.calls = {}
+
+    async def run(self, key, fn):
+        task = self.calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self.calls[key] = task
+            task.add_done_callback(lambda done: self._forget(key, done))
+        return await asyncio.shield(task)
+
+    def _forget(self, key, task):
+        if self.calls.get(key) is task:
+            del self.calls[key]
+
+
+class StreamBroadcast:
+    """Один поток фрагментов, который читают несколько подписчиков
+
+    Каждый подписчик получает все фрагменты с начала, затем новые по мере поступления.
+    """
+
+    def __init__(self):
+        self.chunks = []
+        self.done = False
+        self.changed = asyncio.Event()
+
+    def publish(self, chunk):
+        self.chunks.append(chunk)
+        self._notify()
+
+    def close(self):
+        self.done = True
+        self._notify()
+
+    def _notify(self):
+        changed, self.changed = self.changed, asyncio.Event()
+        changed.set()
+
+    async def subscribe(self):
+        position = 0
+        while True:
+            while position < len(self.chunks):
+                yield self.chunks[position]
+                position += 1
+            if self.done:
+                return
+            await self.changed.wait()
+
+
+class StreamFlight:
+    """Объединение одновременных одинаковых потоковых генераций"""
+
+    def __init__(self):
+        self.broadcasts = {}
+        self.tasks = set()
+
+    def join(self, key, producer):
+        """Подписка на поток с ключом key; producer() запускается только первым запросом"""
+        broadcast = self.broadcasts.get(key)
+        if broadcast is None:
+            broadcast = StreamBroadcast()
+            self.broadcasts[key] = broadcast
+            task = asyncio.ensure_future(self._pump(key, broadcast, producer()))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+        return broadcast.subscribe()
+
+    async def _pump(self, key, broadcast, chunks):
+        try:
+            async for chunk in chunks:
+                broadcast.publish(chunk)
+        finally:
+            if self.broadcasts.get(key) is broadcast:
+                del self.broadcasts[key]
+            broadcast.close()
@@ -0,0 +1,71 @@
+"""Сравнение генерации DOT: прежняя через graphviz.Digraph и прямая текстовая
+
+Пример:
+    python benchmarks/dot_emission.py --nodes 10000
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import GraphCreator as GC  # noqa: E402
+
+
+def legacy_dot_source(fixed_data, filename='bpmn_graph'):
+    """Прежняя реализация create_bpmn_graph (после исправления графа)"""
+    from graphviz import Digraph
+
+    dot = Digraph(filename, format='png')
+    dot.attr(rankdir='LR', splines='ortho')
+    for node in fixed_data['nodes']:
+        style = GC.DEFAULT_NODE_STYLES.get(node['type'], {})
+        dot.node(name=node['id'], label=f"{node['label']}\n({node['id']})", **style)
+    for edge in fixed_data['edges']:
+        label = edge.get('label', '')
+        if edge.get('condition'):
+            label += f"\n[{edge['condition']}]" if label else edge['condition']
+        dot.edge(edge['source'], edge['target'], label=label, fontsize='10', fontcolor='#616161')
+    return dot.source
+
+
+def make_graph(size, seed=1):
+    rng = random.Random(seed)
+    types = list(GC.DEFAULT_NODE_STYLES)
+    nodes = [{"id": f"n{i}", "type": rng.choice(types), "label": f"Задача {i}"} for i in range(size)]
+    edges = [
+        {"source": f"n{i}", "target": f"n{i + 1}", "label": "да" if i % 3 == 0 else ""}
+        for i in range(size - 1)
+    ]
+    return {"nodes": nodes, "edges": edges}
+
+
+def measure(fn, repeat):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--nodes", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    fixed_data = GC.repair_bpmn_data(make_graph(args.nodes))
+    legacy, legacy_time = measure(lambda: legacy_dot_source(fixed_data), args.repeat)
+    direct, direct_time = measure(lambda: GC.build_bpmn_dot_source(fixed_data), args.repeat)
+
+    print(f"nodes={len(fixed_data['nodes'])} edges={len(fixed_data['edges'])}")
+    print(f"Digraph: {len(legacy.encode('utf-8'))} bytes, {legacy_time * 1000:.1f} ms")
+    print(f"direct:  {len(direct.encode('utf-8'))} bytes, {direct_time * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
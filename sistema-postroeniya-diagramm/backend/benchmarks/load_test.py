@@ -0,0 +1,129 @@
+"""Нагрузочный тест бэкенда: пропускная способность при разном числе воркеров
+
+Сценарии:
+    patch             патчи сессий (каждый клиент редактирует свою сессию)
+    patch_render      патчи сессий с отрисовкой SVG
+    visualize         POST /api/visualize_graph, каждый запрос с новым графом (промах кэша)
+    visualize_cached  POST /api/visualize_graph с одним и тем же графом (попадание в кэш)
+
+Пример для уже запущенного сервера:
+    uvicorn main:app --port 8000 --workers 4
+    python benchmarks/load_test.py --url http://127.0.0.1:8000 --clients 16
+
+Перебор числа воркеров (сервер запускается скриптом для каждого значения):
+    python benchmarks/load_test.py --workers 1 2 4 --scenario patch visualize
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import requests
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCENARIOS = ('patch', 'patch_render', 'visualize', 'visualize_cached')
+
+
+def make_graph(size, tag=""):
+    nodes = [{"id": f"n{i}", "type": "UserTask", "label": f"Задача {i}{tag}"} for i in range(size)]
+    edges = [{"source": f"n{i}", "target": f"n{i + 1}"} for i in range(size - 1)]
+    return {"nodes": nodes, "edges": edges}
+
+
+def client(url, scenario, size, deadline, counters, latencies, index):
+    http = requests.Session()
+    session_id = None
+    if scenario in ('patch', 'patch_render'):
+        session_id = http.post(f"{url}/api/graph_sessions", json=make_graph(size)).json()["session_id"]
+    cached_graph = make_graph(size)
+
+    done = 0
+    while time.perf_counter() < deadline:
+        started = time.perf_counter()
+        if session_id is not None:
+            ops = [{"op": "relabel_node", "id": "n0", "label": f"Старт {done}"}]
+            response = http.post(
+                f"{url}/api/graph_sessions/{session_id}/patch",
+                json={"ops": ops, "render": scenario == 'patch_render'}
+            )
+        else:
+            graph = cached_graph if scenario == 'visualize_cached' else make_graph(size, f" {index}.{done}")
+            response = http.post(f"{url}/api/visualize_graph", json={"graph": graph})
+        response.raise_for_status()
+        latencies.append(time.perf_counter() - started)
+        done += 1
+    counters[index] = done
+
+
+def run_scenario(url, scenario, clients, size, duration):
+    counters = [0] * clients
+    latencies = []
+    deadline = time.perf_counter() + duration
+    threads = [
+        threading.Thread(target=client, args=(url, scenario, size, deadline, counters, latencies, i))
+        for i in range(clients)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    total = sum(counters)
+    latencies.sort()
+    p50 = latencies[len(latencies) // 2] * 1000 if latencies else 0
+    p95 = latencies[int(len(latencies) * 0.95)] * 1000 if latencies else 0
+    return total / duration, p50, p95
+
+
+def start_server(port, workers, store_path):
+    env = dict(os.environ, SHARED_STORE_PATH=store_path)
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--workers", str(workers)],
+        cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    url = f"http://127.0.0.1:{port}"
+    for _ in range(300):
+        try:
+            if requests.get(f"{url}/healthz", timeout=1).ok:
+                return process, url
+        except requests.ConnectionError:
+            pass
+        time.sleep(0.1)
+    process.terminate()
+    raise RuntimeError(f"Server with {workers} workers did not start")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--workers", type=int, nargs="*",
+                        help="перебор числа воркеров uvicorn (сервер запускается скриптом)")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--scenario", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--size", type=int, default=2000, help="число узлов в графе")
+    args = parser.parse_args()
+
+    print(f"cpus={os.cpu_count()} clients={args.clients} size={args.size}")
+    for workers in args.workers or [None]:
+        process = None
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            url = args.url
+            if workers is not None:
+                process, url = start_server(args.port, workers, os.path.join(tmp_dir, "store.sqlite3"))
+            try:
+                for scenario in args.scenario:
+                    throughput, p50, p95 = run_scenario(url, scenario, args.clients, args.size, args.duration)
+                    print(f"workers={workers or '-'} scenario={scenario} "
+                          f"throughput={throughput:.1f} req/s p50={p50:.1f} ms p95={p95:.1f} ms")
+            finally:
+                if process is not None:
+                    process.terminate()
+                    process.wait()
+
+
+if __name__ == "__main__":
+    main()
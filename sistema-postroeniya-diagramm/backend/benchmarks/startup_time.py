@@ -0,0 +1,64 @@
+"""Замер времени холодного старта: до ответа /healthz и до готовности /readyz
+
+Примеры (из корня репозитория):
+    python sistema-postroeniya-diagramm/backend/benchmarks/startup_time.py \\
+        --cwd sistema-postroeniya-diagramm/backend --app main:app
+    python sistema-postroeniya-diagramm/backend/benchmarks/startup_time.py \\
+        --cwd llm_service --app server:app
+"""
+import argparse
+import subprocess
+import sys
+import time
+import requests
+
+
+def wait_for(url, started, timeout, expect_ok=True):
+    while time.perf_counter() - started < timeout:
+        try:
+            response = requests.get(url, timeout=1)
+            if response.ok or not expect_ok:
+                return time.perf_counter() - started, response
+        except requests.ConnectionError:
+            pass
+        time.sleep(0.02)
+    return None, None
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--cwd", default=".")
+    parser.add_argument("--app", default="main:app")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--timeout", type=float, default=300.0)
+    args = parser.parse_args()
+
+    base_url = f"http://127.0.0.1:{args.port}"
+    for run in range(args.runs):
+        started = time.perf_counter()
+        process = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", args.app, "--port", str(args.port)],
+            cwd=args.cwd,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL
+        )
+        try:
+            alive, _ = wait_for(f"{base_url}/healthz", started, args.timeout)
+            # /readyz отвечает 503 и во время прогрева, и при ошибке прогрева
+            ready, response = None, None
+            while alive is not None and time.perf_counter() - started < args.timeout:
+                ready, response = wait_for(f"{base_url}/readyz", started, args.timeout, expect_ok=False)
+                if response is None or response.json().get("status") != "warming_up":
+                    break
+                time.sleep(0.05)
+            status = response.json() if response is not None else None
+            print(f"run={run + 1} healthz={alive and round(alive, 3)}s "
+                  f"readyz={ready and round(ready, 3)}s status={status}")
+        finally:
+            process.terminate()
+            process.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,3 @@
-import requests
 import json
 from queue import Queue
 
@@ -17,6 +16,8 @@ class DeepSeekLLM:
         self.base_url = "https://api.deepseek.com/chat/completions"
     
     def generate(self, prompt: str, queue: Queue):
+        import requests  # Ленивый импорт ускоряет запуск сервиса
+
         headers = {
             'Content-Type': 'application/json',
             'Accept': 'text/event-stream',
@@ -93,6 +94,8 @@ class LocalLLM:
         self.base_url = base_url.rstrip("/")
     
     def generate(self, prompt: str, queue: Queue):
+        import requests  # Ленивый импорт ускоряет запуск сервиса
+
         headers = {"Content-Type": "application/json"}
         payload = {
             "model": "current",
@@ -126,4 +129,24 @@ class LocalLLM:
         except Exception as e:
             queue.put({'type':'error','data':str(e)})
         finally:
-            queue.put({'type':'end'})
\ No newline at end of file
+            queue.put({'type':'end'})
+
+class StreamFormatter:
+    """Преобразование событий генерации в текстовый поток с маркерами рассуждений"""
+
+    def __init__(self):
+        self.reasoning_in_progress = False
+
+    def format(self, item):
+        chunks = []
+        if item["type"] == "content":
+            if self.reasoning_in_progress:
+                chunks.append("\n[REASONING_END]\n")
+                self.reasoning_in_progress = False
+            chunks.append(item['data'])
+        elif item["type"] == "reasoning":
+            if not self.reasoning_in_progress:
+                chunks.append("[REASONING_START]\n")
+                self.reasoning_in_progress = True
+            chunks.append(item['data'])
+        return chunks
@@ -1,15 +1,89 @@
 from fastapi import FastAPI, Query, HTTPException
-from fastapi.responses import StreamingResponse, FileResponse
+from fastapi.responses import StreamingResponse, Response, JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
+from pydantic import BaseModel, Field
 from llm_interface import DeepSeekLLM
 from llm_interface import LocalLLM
+from llm_interface import StreamFormatter
 import queue
 import threading
 import asyncio
 import json
+import os
+import tempfile
+import shutil
+import time
+from contextlib import asynccontextmanager
 import GraphCreator as GC
+import HierarchicalLayout as HL
+from GraphSession import GraphSessionStore, SessionNotFound
+from JobManager import JobManager, FINAL_STATUSES, JOB_MAX_PRIORITY
+from SharedStore import SharedStore, make_key, make_llm_key
+from SingleFlight import SingleFlight, StreamFlight
 
-app = FastAPI()
+# Состояние прогрева для /readyz
+startup_state = {"started_at": time.time(), "ready": False, "ready_after": None, "errors": []}
+
+def warm_up():
+    """Фоновый прогрев: тяжёлые импорты, стили и первый запуск Graphviz (кэш шрифтов)"""
+    try:
+        import requests  # noqa: F401
+        GC.compile_theme('default')
+        if shutil.which('dot') is None:
+            raise RuntimeError("Graphviz 'dot' executable not found")
+        warm_graph = {'nodes': [{'id': 'start', 'type': 'StartEvent', 'label': 'Start'}], 'edges': []}
+        GC.build_bpmn_graph(warm_graph, 'warm_up').pipe(format='png')
+    except Exception as e:
+        startup_state["errors"].append(str(e))
+
+    startup_state["ready"] = True
+    startup_state["ready_after"] = round(time.time() - startup_state["started_at"], 3)
+
+@asynccontextmanager
+async def lifespan(app):
+    threading.Thread(target=warm_up, daemon=True).start()
+    # Воркеры задач запускаются сразу: задачи из общей очереди продолжат выполняться после перезапуска
+    jobs.start()
+    yield
+
+app = FastAPI(lifespan=lifespan)
+
+# Общее хранилище: кэши и сессии доступны всем воркерам (uvicorn --workers / WEB_CONCURRENCY)
+shared_store = SharedStore()
+graph_sessions = GraphSessionStore(shared_store)
+jobs = JobManager(shared_store)
+
+RENDER_CACHE_TTL = int(os.getenv("RENDER_CACHE_TTL", "86400"))
+LLM_CACHE_TTL = int(os.getenv("LLM_CACHE_TTL", "86400"))
+# Максимальная длительность одного подключения к потоку задачи (клиент переподключается с offset)
+JOB_STREAM_TIMEOUT = float(os.getenv("JOB_STREAM_TIMEOUT", "600"))
+
+# Одновременные одинаковые запросы выполняются один раз, результат получают все
+render_flights = SingleFlight()
+llm_flights = StreamFlight()
+
+# Очередь рендеринга: ограничение числа одновременных процессов Graphviz в воркере
+render_slots = asyncio.Semaphore(int(os.getenv("RENDER_CONCURRENCY", str(os.cpu_count() or 1))))
+
+class GraphPayload(BaseModel):
+    nodes: list[dict]
+    edges: list[dict]
+
+class VisualizeRequest(BaseModel):
+    graph: GraphPayload
+    theme: str = 'default'
+    mode: str = 'flat'  # 'flat', 'collapsed' или 'hierarchical'
+    cluster: str | None = None  # Развернуть один кластер свёрнутой схемы
+
+class GraphPatch(BaseModel):
+    ops: list[dict]
+    render: bool = False
+
+class JobRequest(BaseModel):
+    kind: str = 'formalize'  # 'formalize' (описание процесса) или 'generate' (произвольный промпт)
+    text: str
+    api_key: str
+    priority: int = Field(0, ge=0, le=JOB_MAX_PRIORITY)  # Больше — раньше в очереди
 
 app.add_middleware(
     CORSMiddleware,
@@ -19,8 +93,30 @@ app.add_middleware(
     allow_methods=["*"]
 )
 
+@app.get("/healthz")
+async def healthz():
+    """Проверка живости: процесс запущен и обслуживает запросы"""
+    return {"status": "alive"}
+
+@app.get("/readyz")
+async def readyz():
+    """Проверка готовности: прогрев завершён без ошибок"""
+    if not startup_state["ready"]:
+        return JSONResponse(status_code=503, content={"status": "warming_up"})
+    content = {
+        "status": "failed" if startup_state["errors"] else "ready",
+        "ready_after": startup_state["ready_after"],
+        "errors": startup_state["errors"]
+    }
+    return JSONResponse(status_code=503 if startup_state["errors"] else 200, content=content)
+
 @app.get("/api/visualize_graph")
-async def visualize_graph(graph_json: str = Query(...)):
+async def visualize_graph(
+    graph_json: str = Query(...),
+    theme: str = Query('default'),
+    mode: str = Query('flat'),
+    cluster: str | None = Query(None)
+):
     # Проверяем валидность JSON
     try:
         parsed_data = json.loads(graph_json)
@@ -29,35 +125,239 @@ async def visualize_graph(graph_json: str = Query(...)):
             status_code=400,
             detail="Неверный формат JSON"
         )
-    
+
+    return await visualize(parsed_data, theme, mode, cluster)
+
+@app.post("/api/visualize_graph")
+async def visualize_graph_post(request: VisualizeRequest):
+    """То же, что GET, но граф передаётся в теле запроса (для больших процессов)"""
+    return await visualize(request.graph.model_dump(), request.theme, request.mode, request.cluster)
+
+@app.post("/api/graph_clusters")
+async def graph_clusters(payload: GraphPayload):
+    """Кластеры, на которые разбивается граф в режимах collapsed/hierarchical"""
+    def partition():
+        fixed_data = GC.repair_bpmn_data(GC.load_bpmn_data(payload.model_dump()))
+        return HL.partition_graph(fixed_data)
+
+    try:
+        clusters = await asyncio.to_thread(partition)
+    except (KeyError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    return [{"id": c['id'], "label": c['label'], "size": len(c['nodes'])} for c in clusters]
+
+def prepare_view(validated_data, mode, cluster):
+    """Исправленный граф и кластеры для свёрнутых режимов (выполняется в отдельном потоке)
+
+    Возвращает (данные для рендеринга, кластеры); кластеры нужны только
+    иерархическому режиму, для остальных — None.
+    """
+    fixed_data = GC.repair_bpmn_data(validated_data)
+    clusters = HL.partition_graph(fixed_data)
+    if cluster is not None:
+        return HL.cluster_data(fixed_data, clusters, cluster), None
+    if mode == 'collapsed':
+        return HL.collapsed_data(fixed_data, clusters), None
+    if mode == 'hierarchical':
+        return fixed_data, clusters
+    raise ValueError(f"Unknown mode: {mode}")
+
+async def visualize(parsed_data, theme='default', mode='flat', cluster=None):
     try:
         # Загрузка и проверка данных
-        validated_data = GC.load_bpmn_data(parsed_data)
-        
-        # Генерация графа
-        graph = GC.create_bpmn_graph(validated_data, 'procurement_process')
-        
-        # Сохранение и рендеринг
-        graph.render(outfile='procurement_process.png', cleanup=True, format='png')
-        
+        validated_data = await asyncio.to_thread(GC.load_bpmn_data, parsed_data)
+
+        # Рендеринг в память, без записи файлов в рабочую директорию
+        # Исправление, разбиение и раскладка выполняются вне цикла событий
+        if mode == 'flat' and cluster is None:
+            image = await render_graph(validated_data, theme, 'png')
+        else:
+            data, clusters = await asyncio.to_thread(prepare_view, validated_data, mode, cluster)
+            if clusters is None:
+                image = await render_graph(data, theme, 'png', repair=False)
+            else:
+                image = await render_hierarchical(data, clusters, theme)
+
     except Exception as e:
         raise HTTPException(
             status_code=400,
             detail=f"Ошибка генерации графа: {str(e)}"
         )
-    
+
     # Возвращаем изображение
-    return FileResponse(
-        "procurement_process.png",
+    return Response(
+        image,
         media_type="image/png",
-        filename="visualization.png"
+        headers={"Content-Disposition": 'inline; filename="visualization.png"'}
     )
 
-@app.get("/api/formalize_process")
-async def formalize_process(descr: str, api_key: str):
+async def render_hierarchical(fixed_data, clusters, theme='default'):
+    """Параллельная раскладка кластеров с кэшем и сборка их в общую схему"""
+    if len(clusters) == 1:
+        return await render_graph(fixed_data, theme, 'png', repair=False)
+
+    cache_key, image = await asyncio.to_thread(cache_lookup, "render_hierarchical", fixed_data, theme)
+    if image is not None:
+        return image
+
+    async def render():
+        # Каждый кластер раскладывается отдельно; результат кэшируется по его содержимому
+        parts = await asyncio.to_thread(lambda: [
+            HL.cluster_data(fixed_data, clusters, c['id'], with_neighbours=False) for c in clusters
+        ])
+        images = await asyncio.gather(*[render_graph(part, theme, 'png', repair=False) for part in parts])
+
+        async with render_slots:
+            image = await asyncio.to_thread(compose_clusters, fixed_data, clusters, images)
+
+        await asyncio.to_thread(shared_store.set, cache_key, image, RENDER_CACHE_TTL)
+        return image
+
+    return await render_flights.run(cache_key, render)
+
+async def render_graph(data, theme='default', fmt='png', repair=True):
+    """Рендеринг графа с кэшированием результата в общем хранилище"""
+    cache_key, image = await asyncio.to_thread(cache_lookup, "render", data, theme, fmt, repair)
+    if image is not None:
+        return image
+
+    async def render():
+        async with render_slots:
+            image = await asyncio.to_thread(draw_graph, data, theme, fmt, repair)
+
+        await asyncio.to_thread(shared_store.set, cache_key, image, RENDER_CACHE_TTL)
+        return image
+
+    return await render_flights.run(cache_key, render)
+
+# Синхронные части рендеринга: вызываются через asyncio.to_thread, чтобы исправление
+# графа, генерация DOT и хэширование больших графов не блокировали цикл событий
+
+def cache_lookup(namespace, *parts):
+    cache_key = make_key(namespace, *parts)
+    return cache_key, shared_store.get(cache_key)
+
+def draw_graph(data, theme, fmt, repair):
+    if repair:
+        graph = GC.create_bpmn_graph(data, 'procurement_process', theme)
+    else:
+        graph = GC.build_bpmn_graph(data, 'procurement_process', theme)
+    return graph.pipe(format=fmt)
+
+def compose_clusters(fixed_data, clusters, images):
+    """Сборка отрисованных кластеров в одну схему"""
+    from graphviz import Source
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        image_paths = {}
+        for c, cluster_image in zip(clusters, images):
+            path = os.path.join(tmp_dir, f"cluster_{len(image_paths)}.png")
+            with open(path, 'wb') as f:
+                f.write(cluster_image)
+            image_paths[c['id']] = path
+
+        source = Source(HL.composed_dot_source(fixed_data, clusters, image_paths, 'procurement_process'))
+        return source.pipe(format='png')
+
+@app.post("/api/graph_sessions")
+async def create_graph_session(payload: GraphPayload):
+    try:
+        validated_data = GC.load_bpmn_data(payload.model_dump())
+        session_id, session = await asyncio.to_thread(graph_sessions.create, validated_data)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    return {
+        "session_id": session_id,
+        "version": session.version,
+        "graph": session.export_to_dict()
+    }
+
+@app.get("/api/graph_sessions/{session_id}")
+async def get_graph_session(session_id: str):
+    session = await asyncio.to_thread(graph_sessions.get, session_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Сессия не найдена")
+    return {"session_id": session_id, "version": session.version, "graph": session.export_to_dict()}
+
+@app.post("/api/graph_sessions/{session_id}/patch")
+async def patch_graph_session(session_id: str, patch: GraphPatch):
+    try:
+        session, diff = await asyncio.to_thread(graph_sessions.apply, session_id, patch.ops)
+    except SessionNotFound:
+        raise HTTPException(status_code=404, detail="Сессия не найдена")
+    except (KeyError, TypeError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=f"Ошибка применения патча: {str(e)}")
+
+    # Раскладку Graphviz нельзя пересчитать частично, поэтому SVG только по запросу
+    if patch.render:
+        graph = await asyncio.to_thread(session.export_to_dict)
+        svg = await render_graph(graph, fmt='svg', repair=False)
+        diff["svg"] = svg.decode('utf-8')
+
+    return diff
+
+@app.delete("/api/graph_sessions/{session_id}")
+async def delete_graph_session(session_id: str):
+    if not await asyncio.to_thread(graph_sessions.delete, session_id):
+        raise HTTPException(status_code=404, detail="Сессия не найдена")
+    return {"status": "deleted"}
+
+async def stream_llm(llm, prompt):
+    """Потоковая генерация; завершённые ответы кэшируются в общем хранилище по API-ключу"""
+    cache_key = make_llm_key(llm.model, prompt, llm.api_key)
+    cached = await asyncio.to_thread(shared_store.get, cache_key)
+    if cached is not None:
+        return StreamingResponse(iter([cached.decode('utf-8')]), media_type="text/event-stream")
+
+    # Одинаковые одновременные запросы с тем же API-ключом подключаются к уже идущей
+    # генерации: ключ кэша содержит хэш API-ключа, поэтому чужой (или неверный) ключ
+    # не получит ни чужой ответ, ни чужую ошибку авторизации
+    stream = llm_flights.join(cache_key, lambda: generate_llm_stream(llm, prompt, cache_key))
+    return StreamingResponse(stream, media_type="text/event-stream")
+
+async def generate_llm_stream(llm, prompt, cache_key):
     output_queue = queue.Queue()
-    llm = DeepSeekLLM(api_key=api_key, model="v3")
 
+    # Запуск генерации в отдельном потоке
+    thread = threading.Thread(
+        target=llm.generate,
+        args=(prompt, output_queue),
+        daemon=True
+    )
+    thread.start()
+
+    formatter = StreamFormatter()
+    chunks = []
+    completed = False
+    while True:
+        try:
+            item = output_queue.get_nowait()
+            
+            if item["type"] in ("content", "reasoning"):
+                for chunk in formatter.format(item):
+                    chunks.append(chunk)
+                    yield chunk
+            elif item["type"] == "error":
+                yield item['data']
+                break
+            elif item["type"] == "end":
+                completed = True
+                break
+                
+            output_queue.task_done()
+        except queue.Empty:
+            await asyncio.sleep(0.05)
+            
+        if not thread.is_alive() and output_queue.empty():
+            break
+
+    if completed and chunks:
+        await asyncio.to_thread(shared_store.set, cache_key, "".join(chunks).encode('utf-8'), LLM_CACHE_TTL)
+
+def build_formalize_prompt(descr):
+    """Промпт для формализации текстового описания процесса в граф BPMN"""
     node_types = "StartEvent, EndEvent, IntermediateCatchEvent, IntermediateThrowEvent, BoundaryEvent, UserTask, ServiceTask, SendTask, ReceiveTask, ManualTask, BusinessRuleTask, ScriptTask, ExclusiveGateway, ParallelGateway, InclusiveGateway, EventBasedGateway, SubProcess, CallActivity, TextAnnotation"
 
     example = """{
@@ -210,87 +510,88 @@ async def formalize_process(descr: str, api_key: str):
   ]
 }"""
 
-    prompt = f'Изучи текстовое описание процесса. Формально опиши его алгоритм в виде графа с типами узлов, используемых в BPMN 2.0.\nОтвет дай в формате JSON. Используй только типы узлов с соответствующим наименованием: {node_types}\nПример корректного ответа: {example}\nОписание процесса: {descr}'
-
-    # Запуск генерации в отдельном потоке
-    thread = threading.Thread(
-        target=llm.generate,
-        args=(prompt, output_queue),
-        daemon=True
-    )
-    thread.start()
+    prompt = f'Изучи текстовое описание процесса. Формально опиши его алгоритм в виде графа с типами узлов, используемых в BPMN 2.0.\nОтвет дай в формате JSON. Используй только типы узлов с соответствующим наименованием: {node_types}\nЕсли шаги процесса вложены в подпроцесс (SubProcess или CallActivity), укажи у каждого вложенного узла поле "parent" с id этого подпроцесса; у остальных узлов поле parent не указывай.\nПример корректного ответа: {example}\nОписание процесса: {descr}'
+    return prompt
 
-    async def stream_generator():
-        reasoning_in_progress = False
-        while True:
-            try:
-                item = output_queue.get_nowait()
-                
-                if item["type"] == "content":
-                    if reasoning_in_progress:
-                        yield "\n[REASONING_END]\n"
-                        reasoning_in_progress = False
-                    yield item['data']
-                elif item["type"] == "reasoning":
-                    if not reasoning_in_progress:
-                        yield "[REASONING_START]\n"
-                        reasoning_in_progress = True
-                    yield item['data']
-                elif item["type"] == "error":
-                    yield item['data']
-                    break
-                elif item["type"] == "end":
-                    break
-                    
-                output_queue.task_done()
-            except queue.Empty:
-                await asyncio.sleep(0.05)
-                
-            if not thread.is_alive() and output_queue.empty():
-                break
+@app.get("/api/formalize_process")
+async def formalize_process(descr: str, api_key: str):
+    llm = DeepSeekLLM(api_key=api_key, model="v3")
 
-    return StreamingResponse(stream_generator(), media_type="text/event-stream")
+    return await stream_llm(llm, build_formalize_prompt(descr))
 
 @app.get("/api/generate")
 async def generate_stream(prompt: str, api_key: str):
-    output_queue = queue.Queue()
     llm = DeepSeekLLM(api_key=api_key, model="r1")
 
-    # Запуск генерации в отдельном потоке
-    thread = threading.Thread(
-        target=llm.generate,
-        args=(prompt, output_queue),
-        daemon=True
-    )
-    thread.start()
+    return await stream_llm(llm, prompt)
+
+@app.post("/api/jobs")
+async def submit_job(request: JobRequest):
+    prompt = build_formalize_prompt(request.text) if request.kind == 'formalize' else request.text
+    try:
+        state = await asyncio.to_thread(jobs.submit, request.kind, prompt, request.api_key, request.priority)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"job_id": state['id'], "status": state['status']}
+
+async def get_job_or_404(job_id):
+    state = await asyncio.to_thread(jobs.get, job_id)
+    if state is None:
+        raise HTTPException(status_code=404, detail="Задача не найдена")
+    return state
+
+@app.get("/api/jobs/{job_id}")
+async def get_job(job_id: str):
+    return await get_job_or_404(job_id)
+
+@app.get("/api/jobs/{job_id}/stream")
+async def stream_job(job_id: str, offset: int = 0):
+    """Подключение (или переподключение) к выводу задачи с позиции offset"""
+    await get_job_or_404(job_id)
 
     async def stream_generator():
-        reasoning_in_progress = False
-        while True:
-            try:
-                item = output_queue.get_nowait()
-                
-                if item["type"] == "content":
-                    if reasoning_in_progress:
-                        yield "\n[REASONING_END]\n"
-                        reasoning_in_progress = False
-                    yield item['data']
-                elif item["type"] == "reasoning":
-                    if not reasoning_in_progress:
-                        yield "[REASONING_START]\n"
-                        reasoning_in_progress = True
-                    yield item['data']
-                elif item["type"] == "error":
-                    yield item['data']
-                    break
-                elif item["type"] == "end":
-                    break
-                    
-                output_queue.task_done()
-            except queue.Empty:
-                await asyncio.sleep(0.05)
-                
-            if not thread.is_alive() and output_queue.empty():
+        position = offset
+        deadline = time.monotonic() + JOB_STREAM_TIMEOUT
+        while time.monotonic() < deadline:
+            state = await asyncio.to_thread(jobs.get, job_id)
+            if state is None:
                 break
+            output = state['output']
+            if len(output) > position:
+                yield output[position:]
+                position = len(output)
+            if state['status'] in FINAL_STATUSES:
+                if state['status'] == 'error' and state['error']:
+                    yield state['error']
+                break
+            if jobs.is_stale(state):
+                # Воркер задачи остановился; место в очереди освободит другой воркер
+                yield "Job stalled: worker stopped"
+                break
+            await asyncio.sleep(0.25)
 
     return StreamingResponse(stream_generator(), media_type="text/event-stream")
+
+@app.get("/api/jobs/{job_id}/image")
+async def get_job_image(job_id: str, theme: str = Query('default')):
+    state = await get_job_or_404(job_id)
+    if state['graph'] is None:
+        raise HTTPException(status_code=409, detail="Граф ещё не готов")
+
+    try:
+        image = await render_graph(state['graph'], theme, 'png')
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Ошибка генерации графа: {str(e)}")
+
+    return Response(
+        image,
+        media_type="image/png",
+        headers={"Content-Disposition": 'inline; filename="visualization.png"'}
+    )
+
+@app.delete("/api/jobs/{job_id}")
+async def cancel_job(job_id: str):
+    state = await asyncio.to_thread(jobs.cancel, job_id)
+    if state is None:
+        raise HTTPException(status_code=404, detail="Задача не найдена")
+    return {"job_id": job_id, "status": state['status']}
@@ -0,0 +1,9 @@
+import os
+import sys
+import tempfile
+
+# Модули бэкенда лежат плоско рядом с main.py
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Общее хранилище тестов не должно попадать в рабочую директорию
+os.environ.setdefault("SHARED_STORE_PATH", os.path.join(tempfile.mkdtemp(), "shared_store.sqlite3"))
@@ -0,0 +1,69 @@
+import re
+
+import pytest
+
+import GraphCreator as GC
+
+graphviz = pytest.importorskip("graphviz")
+
+
+ATTR = re.compile(r'(\w+)=("(?:[^"\\]|\\.)*"|[^\s\]]+)')
+
+
+def parse_nodes(statements):
+    """(идентификатор, атрибуты) для каждой инструкции узла в порядке появления"""
+    nodes = []
+    for statement in statements:
+        statement = statement.strip()
+        name, _, attrs = statement.partition(' [')
+        if '->' in statement or name in ('graph', 'node', 'edge') or not attrs:
+            continue
+        nodes.append((name, dict(ATTR.findall(attrs))))
+    return nodes
+
+
+def digraph_nodes(fixed_data):
+    dot = graphviz.Digraph('bpmn_graph')
+    for node in fixed_data['nodes']:
+        style = GC.DEFAULT_NODE_STYLES.get(node['type'], {})
+        dot.node(name=node['id'], label=f"{node['label']}\n({node['id']})", **style)
+    return parse_nodes(dot.body)
+
+
+def direct_nodes(fixed_data):
+    return parse_nodes(GC.build_bpmn_dot_source(fixed_data).split('\n\t'))
+
+
+def test_nodes_emitted_in_input_order():
+    data = {
+        'nodes': [
+            {'id': 't1', 'type': 'UserTask', 'label': 'Первая'},
+            {'id': 's', 'type': 'StartEvent', 'label': 'Старт'},
+            {'id': 't2', 'type': 'UserTask', 'label': 'Вторая'},
+            {'id': 'e', 'type': 'EndEvent', 'label': 'Конец'}
+        ],
+        'edges': [
+            {'source': 's', 'target': 't1'},
+            {'source': 't1', 'target': 't2'},
+            {'source': 't2', 'target': 'e'}
+        ]
+    }
+    assert direct_nodes(data) == digraph_nodes(data)
+
+
+def test_escaping_matches_digraph():
+    data = {
+        'nodes': [
+            {'id': 'a', 'type': 'ServiceTask', 'label': 'Слева\\l "кавычки"'},
+            {'id': 'b', 'type': 'Unknown', 'label': '<b>'},
+            {'id': 'c d', 'type': 'EndEvent', 'label': 'x'}
+        ],
+        'edges': [
+            {'source': 'a', 'target': 'b', 'label': 'да\\n'},
+            {'source': 'b', 'target': 'c d'}
+        ]
+    }
+    assert direct_nodes(data) == digraph_nodes(data)
+    source = GC.build_bpmn_dot_source(data)
+    assert '\ta -> b [label="да\\n"]' in source
+    assert '\tb -> "c d"' in source
@@ -0,0 +1,160 @@
+import copy
+import json
+import random
+import threading
+
+import GraphCreator as GC
+from GraphSession import GraphSession, GraphSessionStore
+from SharedStore import SharedStore
+
+
+def full_repair(session):
+    return GC.repair_bpmn_data(copy.deepcopy(session.raw.export_to_dict()))
+
+
+def assert_matches_full_repair(session):
+    assert session.graph.export_to_dict() == full_repair(session)
+
+
+def make_graph():
+    return {
+        'nodes': [
+            {'id': 's', 'type': 'StartEvent', 'label': 'S'},
+            {'id': 'a', 'type': 'UserTask', 'label': 'A'},
+            {'id': 'e', 'type': 'EndEvent', 'label': 'E'},
+        ],
+        'edges': [
+            {'source': 's', 'target': 'a'},
+            {'source': 'a', 'target': 'e', 'label': 'да'},
+        ]
+    }
+
+
+def test_repair_artifacts_do_not_accumulate():
+    session = GraphSession(make_graph())
+    session.apply([{'op': 'add_node', 'node': {'id': 'b', 'type': 'UserTask', 'label': 'B'}}])
+    assert 'endEvent_after_b' in {n['id'] for n in session.graph.nodes}
+
+    session.apply([{'op': 'add_edge', 'edge': {'source': 'b', 'target': 'e'}}])
+    diff = session.apply([{'op': 'add_edge', 'edge': {'source': 's', 'target': 'e'}}])
+
+    ids = {n['id'] for n in session.graph.nodes}
+    assert 'endEvent_after_b' not in ids
+    assert 'gate_before_e' in ids
+    assert 'gate_before_e_1' not in ids
+    assert diff['added_nodes'] == []
+    assert_matches_full_repair(session)
+
+
+def test_relabel_updates_generated_labels():
+    session = GraphSession(make_graph())
+    session.apply([{'op': 'add_node', 'node': {'id': 'b', 'type': 'UserTask', 'label': 'B'}}])
+    diff = session.apply([{'op': 'relabel_node', 'id': 'b', 'label': 'Новая'}])
+
+    changed = {n['id']: n['label'] for n in diff['changed_nodes']}
+    assert changed == {'b': 'Новая', 'endEvent_after_b': 'Завершение после Новая'}
+    assert_matches_full_repair(session)
+
+
+def test_failed_patch_is_rolled_back():
+    session = GraphSession(make_graph())
+    before = session.export_to_dict()
+    try:
+        session.apply([
+            {'op': 'add_edge', 'edge': {'source': 's', 'target': 'e'}},
+            {'op': 'remove_node', 'id': 'missing'},
+        ])
+    except ValueError:
+        pass
+    assert session.export_to_dict() == before
+    assert session.version == 0
+
+
+def random_op(session, rng, counter):
+    node_ids = [n['id'] for n in session.raw.nodes]
+    edges = session.raw.edges
+    choice = rng.random()
+    if choice < 0.25 or len(node_ids) < 2:
+        node_type = rng.choice(['UserTask', 'ServiceTask', 'EndEvent', 'ExclusiveGateway'])
+        # Часть id совпадает с id, которые исправление выбрало бы для своих узлов
+        node_id = rng.choice([
+            f"n{counter}",
+            f"endEvent_after_{rng.choice(node_ids or ['n0'])}",
+            f"gate_before_{rng.choice(node_ids or ['n0'])}",
+            f"endEvent_after_{rng.choice(node_ids or ['n0'])}_1",
+        ])
+        if node_id in node_ids:
+            node_id = f"n{counter}"
+        return {'op': 'add_node', 'node': {'id': node_id, 'type': node_type, 'label': f"N{counter}"}}
+    if choice < 0.55:
+        return {'op': 'add_edge', 'edge': {'source': rng.choice(node_ids), 'target': rng.choice(node_ids)}}
+    if choice < 0.65:
+        return {'op': 'remove_node', 'id': rng.choice(node_ids)}
+    if choice < 0.75:
+        return {'op': 'relabel_node', 'id': rng.choice(node_ids), 'label': f"L{counter}"}
+    if not edges:
+        return {'op': 'relabel_node', 'id': rng.choice(node_ids), 'label': f"L{counter}"}
+    edge = rng.choice(edges)
+    if choice < 0.85:
+        return {'op': 'remove_edge', 'source': edge['source'], 'target': edge['target']}
+    return {
+        'op': 'reconnect_edge', 'source': edge['source'], 'target': edge['target'],
+        'new_target': rng.choice(node_ids)
+    }
+
+
+def test_freed_generated_id_is_reused():
+    data = make_graph()
+    data['edges'].pop()
+    session = GraphSession(data)
+    owner = 'a'
+    taken_id = "endEvent_after_a"
+    session.apply([{'op': 'add_node', 'node': {'id': taken_id, 'type': 'EndEvent', 'label': 'Занято'}}])
+    assert_matches_full_repair(session)
+    assert session.end_events[owner]['id'] == f"{taken_id}_1"
+
+    session.apply([{'op': 'remove_node', 'id': taken_id}])
+    assert_matches_full_repair(session)
+    assert session.end_events[owner]['id'] == taken_id
+
+
+def test_random_patches_match_full_repair():
+    for seed in range(300):
+        rng = random.Random(seed)
+        session = GraphSession(make_graph())
+        for counter in range(60):
+            session.apply([random_op(session, rng, counter)])
+            assert_matches_full_repair(session)
+
+
+def test_dump_and_load_keep_state():
+    session = GraphSession(make_graph())
+    session.apply([{'op': 'add_edge', 'edge': {'source': 's', 'target': 'e'}}])
+
+    restored = GraphSession.load(json.loads(json.dumps(session.dump())))
+    assert restored.version == session.version
+    assert restored.export_to_dict() == session.export_to_dict()
+
+    restored.apply([{'op': 'remove_edge', 'source': 's', 'target': 'e'}])
+    assert_matches_full_repair(restored)
+
+
+def test_concurrent_patches_are_not_lost(tmp_path):
+    sessions = GraphSessionStore(SharedStore(str(tmp_path / "store.sqlite3")))
+    session_id, _ = sessions.create(make_graph())
+
+    def worker(index):
+        for i in range(20):
+            sessions.apply(session_id, [{'op': 'add_node', 'node': {
+                'id': f'w{index}_{i}', 'type': 'UserTask', 'label': f'{index}.{i}'}}])
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    session = sessions.get(session_id)
+    assert session.version == 80
+    assert {f'w{t}_{i}' for t in range(4) for i in range(20)} <= {n['id'] for n in session.raw.nodes}
+    assert_matches_full_repair(session)
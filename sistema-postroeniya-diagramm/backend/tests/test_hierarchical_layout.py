@@ -0,0 +1,153 @@
+import shutil
+from collections import Counter
+
+import pytest
+
+import GraphCreator as GC
+import HierarchicalLayout as HL
+
+
+def nested_graph():
+    # Подпроцесс i вложен в подпроцесс o
+    return GC.repair_bpmn_data({
+        'nodes': [
+            {'id': 's', 'type': 'StartEvent', 'label': 'Старт'},
+            {'id': 'o', 'type': 'SubProcess', 'label': 'Внешний'},
+            {'id': 'i', 'type': 'SubProcess', 'label': 'Внутренний', 'parent': 'o'},
+            {'id': 'a', 'type': 'UserTask', 'label': 'A', 'parent': 'i'},
+            {'id': 'b', 'type': 'UserTask', 'label': 'B', 'parent': 'o'},
+            {'id': 'c', 'type': 'UserTask', 'label': 'C'},
+            {'id': 'e', 'type': 'EndEvent', 'label': 'Конец'}
+        ],
+        'edges': [
+            {'source': 's', 'target': 'o'},
+            {'source': 'o', 'target': 'i'},
+            {'source': 'i', 'target': 'a'},
+            {'source': 'a', 'target': 'b'},
+            {'source': 'b', 'target': 'c'},
+            {'source': 'c', 'target': 'e'}
+        ]
+    })
+
+
+def chain(size):
+    return {
+        'nodes': [{'id': f'n{i}', 'type': 'UserTask', 'label': f'{i}'} for i in range(size)],
+        'edges': [{'source': f'n{i}', 'target': f'n{i + 1}'} for i in range(size - 1)]
+    }
+
+
+def assert_valid_partition(data, clusters):
+    ids = [c['id'] for c in clusters]
+    assert len(ids) == len(set(ids))
+    assert not set(ids) & {n['id'] for n in data['nodes']}
+    members = Counter(m for c in clusters for m in c['nodes'])
+    assert members == Counter(n['id'] for n in data['nodes'])
+
+
+def assert_valid_view(view):
+    ids = [n['id'] for n in view['nodes']]
+    assert len(ids) == len(set(ids))
+    assert all(e['source'] != e['target'] for e in view['edges'])
+    assert all(e['source'] in ids and e['target'] in ids for e in view['edges'])
+
+
+def test_nested_containers_share_outer_cluster():
+    data = nested_graph()
+    clusters = HL.partition_graph(data)
+    assert_valid_partition(data, clusters)
+
+    outer = next(c for c in clusters if 'o' in c['nodes'])
+    assert outer['id'] == 'cluster_o'
+    assert outer['nodes'] == ['o', 'i', 'a', 'b']
+
+    assert_valid_view(HL.collapsed_data(data, clusters))
+    for cluster in clusters:
+        assert_valid_view(HL.cluster_data(data, clusters, cluster['id']))
+
+
+def test_repair_nodes_stay_in_owner_container():
+    data = GC.repair_bpmn_data({
+        'nodes': [
+            {'id': 's', 'type': 'StartEvent', 'label': 'Старт'},
+            {'id': 'sp', 'type': 'SubProcess', 'label': 'Подпроцесс'},
+            {'id': 'x', 'type': 'UserTask', 'label': 'X', 'parent': 'sp'},
+            {'id': 'y', 'type': 'UserTask', 'label': 'Y', 'parent': 'sp'},
+            {'id': 'z', 'type': 'UserTask', 'label': 'Z', 'parent': 'sp'}
+        ],
+        'edges': [
+            {'source': 's', 'target': 'sp'},
+            {'source': 'sp', 'target': 'x'},
+            {'source': 'sp', 'target': 'y'},
+            {'source': 'x', 'target': 'z'},
+            {'source': 'y', 'target': 'z'}
+        ]
+    })
+    clusters = HL.partition_graph(data)
+    assert_valid_partition(data, clusters)
+
+    inner, outer = clusters
+    assert inner['id'] == 'cluster_sp'
+    assert set(inner['nodes']) == {'sp', 'x', 'y', 'z', 'gate_before_z', 'endEvent_after_z'}
+    assert outer['nodes'] == ['s']
+    assert outer['label'] == 'Старт'
+
+    # Единственная связь между кластерами: s -> sp
+    edges = HL.collapsed_data(data, clusters)['edges']
+    assert [(e['source'], e['target'], e['label']) for e in edges] == [(outer['id'], 'cluster_sp', '')]
+
+
+def test_chunk_label_counts_nodes():
+    clusters = HL.partition_graph(chain(5), max_cluster_size=3)
+    assert [c['label'] for c in clusters] == ['0 … (узлов: 3)', '3 … (узлов: 2)']
+
+
+def test_cluster_ids_do_not_collide_with_nodes():
+    data = nested_graph()
+    data['nodes'].append({'id': 'cluster_o', 'type': 'UserTask', 'label': 'Занято'})
+    data['edges'].append({'source': 'c', 'target': 'cluster_o'})
+    clusters = HL.partition_graph(data)
+    assert_valid_partition(data, clusters)
+    assert_valid_view(HL.collapsed_data(data, clusters))
+
+
+def test_parent_cycle_and_unknown_parent():
+    data = {
+        'nodes': [
+            {'id': 'p', 'type': 'SubProcess', 'label': 'P', 'parent': 'q'},
+            {'id': 'q', 'type': 'SubProcess', 'label': 'Q', 'parent': 'p'},
+            {'id': 'x', 'type': 'UserTask', 'label': 'X', 'parent': 'missing'}
+        ],
+        'edges': [{'source': 'p', 'target': 'q'}, {'source': 'q', 'target': 'x'}]
+    }
+    assert_valid_partition(data, HL.partition_graph(data))
+
+
+def test_chunks_respect_size_and_keep_cycles_together():
+    data = chain(10)
+    data['edges'].append({'source': 'n5', 'target': 'n3'})
+    clusters = HL.partition_graph(data, max_cluster_size=3)
+    assert_valid_partition(data, clusters)
+    assert all(len(c['nodes']) <= 3 for c in clusters)
+    cycle = next(c for c in clusters if 'n4' in c['nodes'])
+    assert {'n3', 'n4', 'n5'} <= set(cycle['nodes'])
+    assert_valid_view(HL.collapsed_data(data, clusters))
+
+
+@pytest.mark.skipif(shutil.which('dot') is None, reason="Graphviz 'dot' executable not found")
+def test_composed_png_renders(tmp_path):
+    data = GC.repair_bpmn_data(chain(12))
+    clusters = HL.partition_graph(data, max_cluster_size=4)
+    assert len(clusters) > 1
+
+    image_paths = {}
+    for i, cluster in enumerate(clusters):
+        part = HL.cluster_data(data, clusters, cluster['id'], with_neighbours=False)
+        path = tmp_path / f"cluster_{i}.png"
+        path.write_bytes(GC.build_bpmn_graph(part).pipe(format='png'))
+        image_paths[cluster['id']] = str(path)
+
+    from graphviz import Source
+
+    image = Source(HL.composed_dot_source(data, clusters, image_paths)).pipe(format='png')
+    assert image.startswith(b'\x89PNG')
@@ -0,0 +1,129 @@
+import threading
+import time
+
+import pytest
+
+import JobManager as JM
+from SharedStore import SharedStore
+
+
+class FakeLLM:
+    """Генерация, которая идёт, пока тест не разрешит её завершить"""
+
+    running = []
+    max_running = 0
+    release = threading.Event()
+    lock = threading.Lock()
+
+    def __init__(self, api_key, model):
+        self.api_key = api_key
+        self.model = model
+
+    def generate(self, prompt, queue):
+        cls = FakeLLM
+        with cls.lock:
+            cls.running.append(prompt)
+            cls.max_running = max(cls.max_running, len(cls.running))
+        try:
+            while not cls.release.is_set():
+                queue.put({'type': 'content', 'data': '.'})
+                time.sleep(0.02)
+            queue.put({'type': 'content', 'data': prompt})
+            queue.put({'type': 'end'})
+        finally:
+            with cls.lock:
+                cls.running.remove(prompt)
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    monkeypatch.setattr(JM, 'DeepSeekLLM', FakeLLM)
+    monkeypatch.setattr(JM, 'JOB_FLUSH_INTERVAL', 0.05)
+    monkeypatch.setattr(JM, 'JOB_POLL_INTERVAL', 0.05)
+    FakeLLM.running = []
+    FakeLLM.max_running = 0
+    FakeLLM.release = threading.Event()
+    return SharedStore(str(tmp_path / "store.sqlite3"))
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return
+        time.sleep(0.02)
+    raise AssertionError("condition not reached")
+
+
+def test_per_key_limit_is_shared_between_processes(store):
+    # Два менеджера с общим хранилищем — как два воркера uvicorn
+    first = JM.JobManager(store, workers=4, max_per_key=1)
+    second = JM.JobManager(store, workers=4, max_per_key=1)
+    second.start()
+    ids = [first.submit('generate', f'p{i}', 'key')['id'] for i in range(3)]
+
+    wait_for(lambda: len(FakeLLM.running) == 1)
+    time.sleep(0.2)
+    assert FakeLLM.max_running == 1
+
+    FakeLLM.release.set()
+    wait_for(lambda: all(first.get(i)['status'] == 'done' for i in ids))
+    assert FakeLLM.max_running == 1
+    assert [second.get(i)['output'].lstrip('.') for i in ids] == ['p0', 'p1', 'p2']
+
+
+def test_queued_job_is_taken_by_another_process(store):
+    FakeLLM.release.set()
+    # Процесс без воркеров (например, перезапущенный до начала выполнения)
+    stopped = JM.JobManager(store, workers=0)
+    job_id = stopped.submit('generate', 'prompt', 'key')['id']
+    assert stopped.get(job_id)['status'] == 'queued'
+
+    alive = JM.JobManager(store, workers=1)
+    alive.start()
+    wait_for(lambda: alive.get(job_id)['status'] == 'done')
+
+
+def test_cancel_is_not_overwritten_by_running_job(store):
+    manager = JM.JobManager(store, workers=1)
+    job_id = manager.submit('generate', 'prompt', 'key')['id']
+    wait_for(lambda: manager.get(job_id)['status'] == 'running')
+
+    assert manager.cancel(job_id)['status'] == 'cancelled'
+    wait_for(lambda: not FakeLLM.running)
+    FakeLLM.release.set()
+    time.sleep(0.2)
+    assert manager.get(job_id)['status'] == 'cancelled'
+    assert store.get_json(JM.SCHEDULER_KEY) == {'queued': [], 'running': {}}
+
+
+def test_cancel_removes_queued_job(store):
+    manager = JM.JobManager(store, workers=0)
+    job_id = manager.submit('generate', 'prompt', 'key')['id']
+
+    assert manager.cancel(job_id)['status'] == 'cancelled'
+    assert store.get_json(JM.SCHEDULER_KEY)['queued'] == []
+    assert manager.cancel(job_id)['status'] == 'cancelled'
+
+
+def test_stale_running_job_is_reaped(store, monkeypatch):
+    job_id = JM.JobManager(store, workers=0).submit('generate', 'prompt', 'key')['id']
+    # Задачу взял воркер, который затем остановился
+    manager = JM.JobManager(store, workers=1)
+    assert manager._claim() == job_id
+    manager.update(job_id, {'status': 'running'})
+
+    monkeypatch.setattr(JM, 'JOB_STALE_AFTER', 0)
+    time.sleep(0.01)
+    assert manager.is_stale(manager.get(job_id))
+    manager._reap_stale()
+    assert manager.get(job_id)['status'] == 'error'
+    assert store.get_json(JM.SCHEDULER_KEY)['running'] == {}
+
+
+def test_priority_is_bounded(store):
+    manager = JM.JobManager(store, workers=0)
+    for priority in (-1, JM.JOB_MAX_PRIORITY + 1, 10 ** 9):
+        with pytest.raises(ValueError):
+            manager.submit('generate', 'prompt', 'key', priority)
+    assert store.get_json(JM.SCHEDULER_KEY) is None
@@ -0,0 +1,64 @@
+import asyncio
+import time
+
+import pytest
+
+pytest.importorskip("fastapi")
+
+import main
+from SharedStore import SharedStore
+
+
+class FakeLLM:
+    calls = []
+
+    def __init__(self, api_key, model='deepseek-chat'):
+        self.api_key = api_key
+        self.model = model
+
+    def generate(self, prompt, queue):
+        FakeLLM.calls.append(self.api_key)
+        if self.api_key == 'invalid':
+            queue.put({'type': 'error', 'data': "API Error: 401"})
+        else:
+            for word in ('ответ', ' ', self.api_key):
+                time.sleep(0.05)
+                queue.put({'type': 'content', 'data': word})
+        queue.put({'type': 'end'})
+
+
+async def read(response):
+    return "".join([chunk async for chunk in response.body_iterator])
+
+
+def run_concurrently(api_keys, prompt="Опиши процесс"):
+    async def scenario():
+        responses = [await main.stream_llm(FakeLLM(key), prompt) for key in api_keys]
+        return await asyncio.gather(*[read(response) for response in responses])
+
+    return asyncio.run(scenario())
+
+
+@pytest.fixture(autouse=True)
+def isolated(tmp_path, monkeypatch):
+    monkeypatch.setattr(main, 'shared_store', SharedStore(str(tmp_path / "store.sqlite3")))
+    monkeypatch.setattr(main, 'llm_flights', main.StreamFlight())
+    FakeLLM.calls = []
+
+
+def test_same_key_shares_one_generation():
+    assert run_concurrently(['alice', 'alice']) == ['ответ alice', 'ответ alice']
+    assert FakeLLM.calls == ['alice']
+
+
+def test_other_keys_do_not_join_or_receive_errors():
+    assert run_concurrently(['alice', 'invalid', 'bob']) == [
+        'ответ alice', 'API Error: 401', 'ответ bob'
+    ]
+    assert sorted(FakeLLM.calls) == ['alice', 'bob', 'invalid']
+
+
+def test_cache_is_scoped_by_key():
+    run_concurrently(['alice'])
+    assert run_concurrently(['alice', 'invalid']) == ['ответ alice', 'API Error: 401']
+    assert FakeLLM.calls == ['alice', 'invalid']
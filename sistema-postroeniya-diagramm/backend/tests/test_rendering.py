@@ -0,0 +1,66 @@
+import asyncio
+import time
+
+import pytest
+
+pytest.importorskip("fastapi")
+
+import main
+from SharedStore import SharedStore
+
+GRAPH = {
+    'nodes': [
+        {'id': 's', 'type': 'StartEvent', 'label': 'Старт'},
+        {'id': 'e', 'type': 'EndEvent', 'label': 'Конец'}
+    ],
+    'edges': [{'source': 's', 'target': 'e'}]
+}
+
+
+class SlowGraph:
+    def pipe(self, format):
+        return b'image'
+
+
+def slow(result):
+    def build(*args, **kwargs):
+        time.sleep(0.5)
+        return result(*args, **kwargs)
+    return build
+
+
+@pytest.fixture(autouse=True)
+def isolated(tmp_path, monkeypatch):
+    monkeypatch.setattr(main, 'shared_store', SharedStore(str(tmp_path / "store.sqlite3")))
+    monkeypatch.setattr(main, 'render_flights', main.SingleFlight())
+    monkeypatch.setattr(main.GC, 'create_bpmn_graph', slow(lambda *args: SlowGraph()))
+    monkeypatch.setattr(main.GC, 'build_bpmn_graph', slow(lambda *args: SlowGraph()))
+
+
+def max_loop_gap(coroutine):
+    """Наибольшая пауза цикла событий, пока выполняется coroutine"""
+    async def scenario():
+        gaps = []
+        task = asyncio.ensure_future(coroutine)
+        last = time.perf_counter()
+        while not task.done():
+            await asyncio.sleep(0.01)
+            now = time.perf_counter()
+            gaps.append(now - last)
+            last = now
+        return await task, max(gaps)
+
+    return asyncio.run(scenario())
+
+
+def test_graph_is_built_off_the_event_loop():
+    image, gap = max_loop_gap(main.render_graph(GRAPH))
+    assert image == b'image'
+    assert gap < 0.2
+
+
+def test_collapsed_view_is_prepared_off_the_event_loop(monkeypatch):
+    monkeypatch.setattr(main.HL, 'partition_graph', slow(main.HL.partition_graph))
+    response, gap = max_loop_gap(main.visualize(GRAPH, mode='collapsed'))
+    assert response.body == b'image'
+    assert gap < 0.2